@@ -1,17 +1,22 @@
 # ai.py
 from __future__ import annotations
+import hashlib
 import os
-import re
+import threading
 import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Tuple
 
 from flask import request
-from firebase_admin import auth, firestore
+from firebase_admin import firestore
 from dotenv import load_dotenv
 
+from common import get_db, logger, verify_id_token
+
 load_dotenv()
-db = firestore.client()
+db = get_db()
+log = logger.getChild("ai")
 
 # -----------------------------------------------------------------------------
 # Gemini config
@@ -32,14 +37,77 @@ except Exception:
     except Exception:
         GENAI_MODE = None
 
+# Optional Redis (shared rate-limit state across workers); local fallback if absent
+try:
+    import redis as _redis
+    _REDIS_OK = True
+except Exception:
+    _REDIS_OK = False
+
 
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
 GOOGLE_API_KEY = (os.getenv("GOOGLE_API_KEY") or "").strip() 
 
 MAX_MSGS = 5
-MIN_SECONDS_BETWEEN_CALLS = 0.8  # was 2.0
-_last_call_at: Dict[str, float] = {}
-_inflight_user: Dict[str, bool] = {}  # simple in-flight guard per uid
+
+# Token bucket per uid: bursts up to CAPACITY, refilled at REFILL_PER_SEC
+RATE_LIMIT_CAPACITY = 5
+RATE_LIMIT_REFILL_PER_SEC = 1.0
+REDIS_URL = (os.getenv("REDIS_URL") or "").strip()
+RATE_LIMIT_MAX_UIDS = 100_000
+# uid -> (tokens, last_refill), least recently used first. A bucket idle for
+# capacity / refill seconds is full again, i.e. the same as no entry at all.
+_buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+_buckets_lock = threading.Lock()
+_redis_client = None
+_redis_bucket = None
+
+# Lazily-built SDK handles, reused across requests (keeps the HTTP pool warm)
+_NEW_CLIENT = None
+_OLD_MODEL = None
+_client_lock = threading.Lock()
+GEMINI_MAX_KEEPALIVE = 16
+GEMINI_KEEPALIVE_EXPIRY_SECONDS = 300.0
+GEMINI_TIMEOUT_MS = 15_000
+
+# Exact-prompt reply cache: sha256(model + prompt) -> (stored_at, reply)
+LLM_CACHE_MAX = 1024
+LLM_CACHE_TTL_SECONDS = 600.0
+_llm_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+_llm_cache_lock = threading.Lock()
+
+# Optional semantic cache for near-duplicate prompts (opt-in: SEMANTIC_CACHE=1,
+# needs sentence-transformers). Rows are L2-normalized embeddings in a ring buffer.
+SEMANTIC_CACHE_ENABLED = (os.getenv("SEMANTIC_CACHE") or "").strip().lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "all-MiniLM-L6-v2")
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_MAX = 1024
+_sem_model = None
+_sem_vecs = None  # np.ndarray (SEMANTIC_CACHE_MAX, dim)
+_sem_meta: List[Any] = [None] * SEMANTIC_CACHE_MAX  # (stored_at, namespace, reply) per row
+_sem_next = 0
+_sem_lock = threading.Lock()
+
+if SEMANTIC_CACHE_ENABLED:
+    try:
+        import numpy as np
+        from sentence_transformers import SentenceTransformer
+    except Exception as e:
+        log.warning("Semantic cache disabled: %s: %s", type(e).__name__, e)
+        SEMANTIC_CACHE_ENABLED = False
+
+# Last-N messages per conversation. Entries are tagged with the conversation's
+# `messagesVersion` (bumped by every message writer) so a new message misses.
+CONV_CACHE_MAX = 512
+CONV_CACHE_TTL_SECONDS = 30.0
+_conv_cache: "OrderedDict[Tuple[str, int], Tuple[float, Any, List[Msg]]]" = OrderedDict()
+_conv_cache_lock = threading.Lock()
+
+# Suggested reply per (me, partner, blake2b of the tail's message ids)
+REPLY_CACHE_MAX = 2048
+REPLY_CACHE_TTL_SECONDS = 600.0
+_reply_cache: "OrderedDict[Tuple[str, str, str], Tuple[float, str]]" = OrderedDict()
+_reply_cache_lock = threading.Lock()
 
 # -----------------------------------------------------------------------------
 # Data
@@ -60,62 +128,108 @@ def return_api_key():
 
 def _require_auth() -> str:
     authz = request.headers.get("Authorization", "")
-    m = re.match(r"^Bearer\s+(.+)$", authz, re.I)
-    if not m:
+    id_token = authz[7:].strip() if authz[:7].lower() == "bearer " else ""
+    if not id_token:
         raise PermissionError("Missing Authorization Bearer token")
-    id_token = m.group(1)
-    decoded = auth.verify_id_token(id_token)
+    decoded = verify_id_token(id_token)
     return decoded["uid"]
 
-def _conv_id_for(a: str, b: str) -> str:
-    return "__".join(sorted([a, b]))
+# Atomic refill + take in one round-trip. Returns 1 if a token was taken.
+_TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1]) or capacity
+local ts = tonumber(b[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return allowed
+"""
+
+def _get_redis_bucket():
+    global _redis_client, _redis_bucket
+    if not (_REDIS_OK and REDIS_URL):
+        return None
+    if _redis_bucket is None:
+        with _client_lock:
+            if _redis_bucket is None:
+                _redis_client = _redis.Redis.from_url(REDIS_URL)
+                _redis_bucket = _redis_client.register_script(_TOKEN_BUCKET_LUA)
+    return _redis_bucket
+
+def _take_token_local(uid: str, now: float) -> bool:
+    with _buckets_lock:
+        tokens, last = _buckets.get(uid, (float(RATE_LIMIT_CAPACITY), now))
+        tokens = min(float(RATE_LIMIT_CAPACITY), tokens + max(0.0, now - last) * RATE_LIMIT_REFILL_PER_SEC)
+        allowed = tokens >= 1.0
+        if allowed:
+            tokens -= 1.0
+        _buckets[uid] = (tokens, now)
+        _buckets.move_to_end(uid)
+        idle_full = RATE_LIMIT_CAPACITY / RATE_LIMIT_REFILL_PER_SEC
+        while _buckets:
+            oldest_uid, (_, oldest_at) = next(iter(_buckets.items()))
+            if len(_buckets) <= RATE_LIMIT_MAX_UIDS and now - oldest_at < idle_full:
+                break
+            del _buckets[oldest_uid]
+        return allowed
 
 def _rate_limit(uid: str):
     now = time.time()
-    last = _last_call_at.get(uid, 0.0)
-    if now - last < MIN_SECONDS_BETWEEN_CALLS:
+    allowed = None
+    bucket = _get_redis_bucket()
+    if bucket is not None:
+        try:
+            allowed = bool(bucket(keys=[f"ratelimit:ai:{uid}"],
+                                  args=[RATE_LIMIT_CAPACITY, RATE_LIMIT_REFILL_PER_SEC, now]))
+        except Exception as e:
+            log.warning("Redis rate-limit error, using local bucket: %s: %s", type(e).__name__, e)
+    if allowed is None:
+        allowed = _take_token_local(uid, now)
+    if not allowed:
         raise RuntimeError("Please wait a moment before asking again.")
-    _last_call_at[uid] = now
 
 # -----------------------------------------------------------------------------
 # Firestore
 # -----------------------------------------------------------------------------
 def _fetch_last_messages(conv_id: str, limit: int = MAX_MSGS) -> List[Msg]:
     """
-    Read from conversations/{convId}/messages only (no composite index needed).
+    Read from conversations/{convId}/messages only (single-field createdAt index).
     Returns newest -> oldest (DESC). _build_prompt() already reverses to chronological.
     """
     msgs: List[Msg] = []
-    col = (
-        db.collection("conversations")
-        .document(conv_id)
-        .collection("messages")
-    )
+    conv_ref = db.collection("conversations").document(conv_id)
+    col = conv_ref.collection("messages")
 
-    def _to_epoch_ms(v) -> int:
-        # Normalize Firestore Timestamp / seconds / ms to epoch ms (int)
-        try:
-            # google.cloud.firestore_v1._helpers.Timestamp has .timestamp()
-            return int(v.timestamp() * 1000)  # type: ignore[attr-defined]
-        except Exception:
-            pass
-        if isinstance(v, (int, float)):
-            # Heuristic: >= 1e12 already ms, else seconds
-            return int(v if v >= 1_000_000_000_000 else v * 1000)
-        return 0
-
-    # Preferred path: order by createdAt DESC (single-field index not required)
+    # Read the version before the messages: a write in between only causes a miss later
     try:
-        q = col.order_by("createdAt", direction=firestore.Query.DESCENDING).limit(limit)
-        docs = list(q.stream())
+        head = conv_ref.get(field_paths=["messagesVersion"])
+        version = (head.to_dict() or {}).get("messagesVersion") if head.exists else None
     except Exception:
-        # Fallback: no order_by, then sort in memory by createdAt/createdAtMs DESC
-        docs = list(col.limit(limit).stream())
-        docs.sort(
-            key=lambda d: _to_epoch_ms((d.to_dict() or {}).get("createdAt"))
-                          or int((d.to_dict() or {}).get("createdAtMs") or 0),
-            reverse=True,
-        )
+        version = None
+
+    cache_key = (conv_id, limit)
+    if version is not None:
+        with _conv_cache_lock:
+            hit = _conv_cache.get(cache_key)
+            if hit and hit[1] == version and time.time() - hit[0] <= CONV_CACHE_TTL_SECONDS:
+                _conv_cache.move_to_end(cache_key)
+                return list(hit[2])
+
+    # createdAt is single-field indexed automatically; no client-side sort fallback
+    q = (
+        col.select(["from", "to", "text", "createdAt"])
+        .order_by("createdAt", direction=firestore.Query.DESCENDING)
+        .limit(limit)
+    )
+    docs = list(q.stream())
 
     for d in docs:
         data = d.to_dict() or {}
@@ -124,27 +238,26 @@ def _fetch_last_messages(conv_id: str, limit: int = MAX_MSGS) -> List[Msg]:
                 id=d.id,
                 from_uid=data.get("from", ""),
                 to_uid=data.get("to", ""),
-                text=data.get("text", ""),
+                text=(data.get("text") or "").strip(),
                 created_at=data.get("createdAt"),
             )
         )
 
+    if version is not None:
+        with _conv_cache_lock:
+            _conv_cache[cache_key] = (time.time(), version, list(msgs))
+            _conv_cache.move_to_end(cache_key)
+            while len(_conv_cache) > CONV_CACHE_MAX:
+                _conv_cache.popitem(last=False)
+
     return msgs
 
 # -----------------------------------------------------------------------------
 # Prompt
 # -----------------------------------------------------------------------------
-def _build_prompt(messages: List[Msg], me_uid: str) -> str:
-    ordered = list(reversed(messages))
-    lines = []
-    for m in ordered:
-        role = "ME" if m.from_uid == me_uid else "THEM"
-        t = (m.text or "").strip()
-        if t:
-            lines.append(f"{role}: {t}")
-    history = "\n".join(lines) if lines else "(No prior messages)"
-
-    return f"""You are assisting a user in a chat. Read the last few messages and craft the NEXT single reply the user (ME) should send.
+# Static instructions go first (and to system_instruction on the new SDK) so the
+# prefix is byte-identical across calls and Gemini's prompt cache can hit.
+REPLY_INSTRUCTIONS = """You are assisting a user in a chat. Read the last few messages and craft the NEXT single reply the user (ME) should send.
 
 Goals:
 - Mirror the existing tone but keep it professional, clear, and friendly.
@@ -152,70 +265,288 @@ Goals:
 - If there's a question to answer, answer directly. If next step is needed, propose one.
 - Avoid emojis unless prior tone clearly uses them.
 - Output only the reply text, with no quotes or role tags.
+- Return ONLY the reply text for ME to send next.
+"""
 
-Conversation (oldest → newest):
-{history}
+_HISTORY_TEMPLATE = "Conversation (oldest → newest):\n{history}\n"
 
-Return ONLY the reply text for ME to send next.
-"""
+def _build_prompt(messages: List[Msg], me_uid: str) -> str:
+    """Dynamic tail of the prompt: the conversation only (pair with REPLY_INSTRUCTIONS)."""
+    # messages arrive newest-first with text already stripped by _fetch_last_messages
+    history = "\n".join(
+        f"{'ME' if m.from_uid == me_uid else 'THEM'}: {m.text}"
+        for m in reversed(messages)
+        if m.text
+    )
+    return _HISTORY_TEMPLATE.format_map({"history": history or "(No prior messages)"})
 
 # -----------------------------------------------------------------------------
 # Gemini callers
 # -----------------------------------------------------------------------------
-def _call_gemini_new(prompt: str) -> str:
+def _http_options():
+    """
+    google-genai talks to Gemini through httpx. Give its (per-client, reused)
+    pool keep-alive limits and a request timeout, and HTTP/2 when the `h2` extra
+    is installed so concurrent calls multiplex over one connection.
+    Returns None (SDK defaults) on a google-genai without HttpOptions.client_args.
+    """
+    try:
+        import httpx
+        from google.genai import types as genai_types
+    except Exception:
+        return None
+
+    client_args: Dict[str, Any] = {
+        "limits": httpx.Limits(
+            max_keepalive_connections=GEMINI_MAX_KEEPALIVE,
+            keepalive_expiry=GEMINI_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+    }
+    try:
+        import h2  # noqa: F401
+        client_args["http2"] = True
+    except Exception:
+        pass
+
+    try:
+        return genai_types.HttpOptions(
+            timeout=GEMINI_TIMEOUT_MS,
+            client_args=client_args,
+        )
+    except Exception:
+        return None
+
+def _get_new_client():
+    global _NEW_CLIENT
+    if _NEW_CLIENT is None:
+        with _client_lock:
+            if _NEW_CLIENT is None:
+                opts = _http_options()
+                if opts is not None:
+                    _NEW_CLIENT = NEW_GENAI.Client(api_key=GOOGLE_API_KEY, http_options=opts)  # type: ignore
+                else:
+                    _NEW_CLIENT = NEW_GENAI.Client(api_key=GOOGLE_API_KEY)  # type: ignore
+    return _NEW_CLIENT
+
+def _get_old_model():
+    global _OLD_MODEL
+    if _OLD_MODEL is None:
+        with _client_lock:
+            if _OLD_MODEL is None:
+                OLD_GENAI.configure(api_key=GOOGLE_API_KEY)  # type: ignore
+                _OLD_MODEL = OLD_GENAI.GenerativeModel(GEMINI_MODEL)  # type: ignore
+    return _OLD_MODEL
+
+def _resp_text(resp) -> str | None:
+    text = getattr(resp, "text", None)
+    if not text:
+        cand = getattr(resp, "candidates", None)
+        if cand:
+            try:
+                parts = cand[0].content.parts
+                text = "".join(getattr(p, "text", "") for p in parts)
+            except Exception:
+                pass
+    return text
+
+def _new_config(system_instruction: str | None):
+    return {"system_instruction": system_instruction} if system_instruction else None
+
+def _old_prompt(prompt: str, system_instruction: str | None) -> str:
+    # Legacy model is shared, so keep the instructions as a stable prefix instead
+    return f"{system_instruction}\n{prompt}" if system_instruction else prompt
+
+def _call_gemini_new(prompt: str, system_instruction: str | None = None) -> str:
     if not GOOGLE_API_KEY:
         raise RuntimeError("GOOGLE_API_KEY environment variable is not set")
 
     try:
-        client = NEW_GENAI.Client(api_key=GOOGLE_API_KEY)  # type: ignore
-        resp = client.models.generate_content(model=GEMINI_MODEL, contents=prompt)  # type: ignore
-        text = getattr(resp, "text", None)
-        if not text:
-            cand = getattr(resp, "candidates", None)
-            if cand:
-                try:
-                    parts = cand[0].content.parts
-                    text = "".join(getattr(p, "text", "") for p in parts)
-                except Exception:
-                    pass
+        client = _get_new_client()
+        resp = client.models.generate_content(model=GEMINI_MODEL, contents=prompt, config=_new_config(system_instruction))  # type: ignore
+        text = _resp_text(resp)
         if not text or not text.strip():
             raise RuntimeError("Empty response from Gemini (new SDK)")
         return text.strip()
     except Exception as e:
         # Surface SDK errors as RuntimeError (so route returns 400 with details)
-        print(f"[ai] Gemini NEW error: {type(e).__name__}: {e}")
+        log.warning("Gemini NEW error: %s: %s", type(e).__name__, e)
         raise RuntimeError(f"Gemini error (new): {type(e).__name__}: {e}")
 
-def _call_gemini_old(prompt: str) -> str:
+def _call_gemini_old(prompt: str, system_instruction: str | None = None) -> str:
     if not GOOGLE_API_KEY:
         raise RuntimeError("GOOGLE_API_KEY environment variable is not set")
 
     try:
-        OLD_GENAI.configure(api_key=GOOGLE_API_KEY)  # type: ignore
-        model = OLD_GENAI.GenerativeModel(GEMINI_MODEL)  # type: ignore
-        resp = model.generate_content(prompt)
-        text = getattr(resp, "text", None)
-        if not text and hasattr(resp, "candidates") and resp.candidates:
-            parts = getattr(resp.candidates[0].content, "parts", [])
-            text = "".join(getattr(p, "text", "") for p in parts)
+        model = _get_old_model()
+        resp = model.generate_content(_old_prompt(prompt, system_instruction))
+        text = _resp_text(resp)
         if not text or not text.strip():
             raise RuntimeError("Empty response from Gemini (old SDK)")
         return text.strip()
     except Exception as e:
-        print(f"[ai] Gemini OLD error: {type(e).__name__}: {e}")
+        log.warning("Gemini OLD error: %s: %s", type(e).__name__, e)
         raise RuntimeError(f"Gemini error (old): {type(e).__name__}: {e}")
 
-def _call_gemini(prompt: str) -> str:
+def _llm_cache_key(prompt: str, system_instruction: str | None = None) -> str:
+    raw = GEMINI_MODEL + "\0" + (system_instruction or "") + "\0" + prompt
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _llm_cache_get(key: str) -> str | None:
+    with _llm_cache_lock:
+        hit = _llm_cache.get(key)
+        if not hit:
+            return None
+        stored_at, text = hit
+        if time.time() - stored_at > LLM_CACHE_TTL_SECONDS:
+            del _llm_cache[key]
+            return None
+        _llm_cache.move_to_end(key)
+        return text
+
+def _llm_cache_put(key: str, text: str) -> None:
+    with _llm_cache_lock:
+        _llm_cache[key] = (time.time(), text)
+        _llm_cache.move_to_end(key)
+        while len(_llm_cache) > LLM_CACHE_MAX:
+            _llm_cache.popitem(last=False)
+
+def _messages_sig(messages: List[Msg]) -> str:
+    """Identifies a conversation tail by its message ids (any new message changes it)."""
+    return hashlib.blake2b(
+        b"|".join(m.id.encode("utf-8") for m in messages), digest_size=16
+    ).hexdigest()
+
+def _reply_cache_get(key: Tuple[str, str, str]) -> str | None:
+    with _reply_cache_lock:
+        hit = _reply_cache.get(key)
+        if not hit:
+            return None
+        if time.time() - hit[0] > REPLY_CACHE_TTL_SECONDS:
+            del _reply_cache[key]
+            return None
+        _reply_cache.move_to_end(key)
+        return hit[1]
+
+def _reply_cache_put(key: Tuple[str, str, str], text: str) -> None:
+    with _reply_cache_lock:
+        _reply_cache[key] = (time.time(), text)
+        _reply_cache.move_to_end(key)
+        while len(_reply_cache) > REPLY_CACHE_MAX:
+            _reply_cache.popitem(last=False)
+
+def _semantic_embed(prompt: str):
+    global _sem_model, SEMANTIC_CACHE_ENABLED
+    if _sem_model is None:
+        with _sem_lock:
+            if _sem_model is None:
+                try:
+                    _sem_model = SentenceTransformer(SEMANTIC_CACHE_MODEL)
+                except Exception as e:
+                    log.warning("Semantic cache disabled: %s: %s", type(e).__name__, e)
+                    SEMANTIC_CACHE_ENABLED = False
+                    return None
+    return _sem_model.encode(prompt, normalize_embeddings=True).astype(np.float32)
+
+def _semantic_get(namespace: str, emb) -> str | None:
+    with _sem_lock:
+        if _sem_vecs is None:
+            return None
+        sims = _sem_vecs @ emb
+        now = time.time()
+        for row in np.argsort(-sims):
+            if sims[row] < SEMANTIC_CACHE_THRESHOLD:
+                return None
+            meta = _sem_meta[row]
+            if meta and meta[1] == namespace and now - meta[0] <= LLM_CACHE_TTL_SECONDS:
+                return meta[2]
+    return None
+
+def _semantic_put(namespace: str, emb, text: str) -> None:
+    global _sem_vecs, _sem_next
+    with _sem_lock:
+        if _sem_vecs is None:
+            _sem_vecs = np.zeros((SEMANTIC_CACHE_MAX, emb.shape[0]), dtype=np.float32)
+        _sem_vecs[_sem_next] = emb
+        _sem_meta[_sem_next] = (time.time(), namespace, text)
+        _sem_next = (_sem_next + 1) % SEMANTIC_CACHE_MAX
+
+def _cache_lookup(prompt: str, system_instruction: str | None, scope: str) -> Tuple[str, Any, str | None]:
+    """Exact cache first, then (if enabled) nearest cached prompt above the threshold.
+    Near matches are only taken from the same scope (e.g. one viewer's conversation),
+    so a similar chat can never hand back another user's reply.
+    Returns (exact_key, embedding_or_None, cached_reply_or_None)."""
+    key = _llm_cache_key(prompt, system_instruction)
+    cached = _llm_cache_get(key)
+    if cached is not None or not SEMANTIC_CACHE_ENABLED:
+        return key, None, cached
+    emb = _semantic_embed(prompt)
+    if emb is None:
+        return key, None, None
+    return key, emb, _semantic_get(_llm_cache_key(scope, system_instruction), emb)
+
+def _cache_store(key: str, emb, system_instruction: str | None, scope: str, text: str) -> None:
+    _llm_cache_put(key, text)
+    if emb is not None:
+        _semantic_put(_llm_cache_key(scope, system_instruction), emb, text)
+
+_NO_SDK_MSG = (
+    "No Gemini SDK found. Install one of:\n"
+    "  pip install google-genai        # new client (from google import genai)\n"
+    "  or\n"
+    "  pip install google-generativeai # legacy client"
+)
+
+def _call_gemini(prompt: str, system_instruction: str | None = None, cache_scope: str = "") -> str:
+    key, emb, cached = _cache_lookup(prompt, system_instruction, cache_scope)
+    if cached is not None:
+        return cached
+
     if GENAI_MODE == "new" and NEW_GENAI is not None:
-        return _call_gemini_new(prompt)
-    if GENAI_MODE == "old" and OLD_GENAI is not None:
-        return _call_gemini_old(prompt)
-    raise RuntimeError(
-        "No Gemini SDK found. Install one of:\n"
-        "  pip install google-genai        # new client (from google import genai)\n"
-        "  or\n"
-        "  pip install google-generativeai # legacy client"
-    )
+        text = _call_gemini_new(prompt, system_instruction)
+    elif GENAI_MODE == "old" and OLD_GENAI is not None:
+        text = _call_gemini_old(prompt, system_instruction)
+    else:
+        raise RuntimeError(_NO_SDK_MSG)
+    _cache_store(key, emb, system_instruction, cache_scope, text)
+    return text
+
+def _call_gemini_stream(prompt: str, system_instruction: str | None = None, cache_scope: str = "") -> Iterator[str]:
+    """
+    Yield reply text chunks as Gemini produces them. The joined reply is stored
+    in the reply cache, and a cache hit is yielded as a single chunk.
+    """
+    if not GOOGLE_API_KEY:
+        raise RuntimeError("GOOGLE_API_KEY environment variable is not set")
+
+    key, emb, cached = _cache_lookup(prompt, system_instruction, cache_scope)
+    if cached is not None:
+        yield cached
+        return
+
+    if GENAI_MODE == "new" and NEW_GENAI is not None:
+        stream = _get_new_client().models.generate_content_stream(  # type: ignore
+            model=GEMINI_MODEL, contents=prompt, config=_new_config(system_instruction)
+        )
+    elif GENAI_MODE == "old" and OLD_GENAI is not None:
+        stream = _get_old_model().generate_content(_old_prompt(prompt, system_instruction), stream=True)
+    else:
+        raise RuntimeError(_NO_SDK_MSG)
+
+    parts: List[str] = []
+    try:
+        for chunk in stream:
+            text = _resp_text(chunk)
+            if text:
+                parts.append(text)
+                yield text
+    except Exception as e:
+        log.warning("Gemini stream error: %s: %s", type(e).__name__, e)
+        raise RuntimeError(f"Gemini error (stream): {type(e).__name__}: {e}")
+
+    full = "".join(parts).strip()
+    if not full:
+        raise RuntimeError("Empty response from Gemini (stream)")
+    _cache_store(key, emb, system_instruction, cache_scope, full)
 
 # Optional: log once
-print(f"[ai] GENAI_MODE={GENAI_MODE}, MODEL={GEMINI_MODEL}")
+log.info("GENAI_MODE=%s, MODEL=%s", GENAI_MODE, GEMINI_MODEL)
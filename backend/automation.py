@@ -4,14 +4,19 @@ from __future__ import annotations
 import os
 import re
 import json
+import secrets
+import sys
+import threading
 import time
 import uuid
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta, timezone, tzinfo
+from functools import lru_cache
 from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
 
 
 from flask import Blueprint, request, jsonify
-from firebase_admin import auth as fb_auth, firestore
+from common import get_db, verify_id_token
 
 # Optional Google Calendar / Meet imports (graceful fallback if not installed)
 try:
@@ -25,7 +30,7 @@ except Exception:
 # Blueprint
 # --------------------------------------------------------------------------------------
 
-db = firestore.client()
+db = get_db()
 
 # --------------------------------------------------------------------------------------
 # Helpers: auth, errors, utils
@@ -49,7 +54,7 @@ def _require_user() -> Tuple[Optional[Dict[str, Any]], Optional[Tuple[Any, int]]
     if not token:
         return None, _json_error(401, "Missing Authorization: Bearer <token>")
     try:
-        claims = fb_auth.verify_id_token(token)
+        claims = verify_id_token(token)
         return claims, None
     except Exception as e:
         return None, _json_error(401, f"Invalid token: {e}")
@@ -57,8 +62,10 @@ def _require_user() -> Tuple[Optional[Dict[str, Any]], Optional[Tuple[Any, int]]
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
-def _conv_id_for(a: str, b: str) -> str:
-    return "__".join(sorted([a, b]))
+def _fake_meet_url() -> str:
+    # One 5-byte draw -> 10 hex chars in Meet's xxx-xxxx-xxx shape
+    t = secrets.token_hex(5)
+    return f"https://meet.google.com/{t[:3]}-{t[3:7]}-{t[7:]}"
 
 def _safe_email(s: Optional[str]) -> Optional[str]:
     if not s:
@@ -77,21 +84,35 @@ POS_WORDS = r"\b(yes|interested|sounds good|great|awesome|sure|let'?s do it|keen
 NEG_WORDS = r"\b(no|not interested|stop|unsubscribe|never|remove me|pass)\b"
 LATER_WORDS = r"\b(later|busy|another time|next week|follow up|remind)\b"
 
+# One alternation, scanned once; named groups tell us which bucket matched
+_INTENT_RE = re.compile(f"(?P<neg>{NEG_WORDS})|(?P<later>{LATER_WORDS})|(?P<pos>{POS_WORDS})", re.I)
+_POS_SENTIMENT_RE = re.compile(r"\b(good|great|thanks|thank you|helpful|love)\b")
+_NEG_SENTIMENT_RE = re.compile(r"\b(bad|hate|terrible|annoyed|spam)\b")
+
+_INTENT_RESULTS = {
+    "neg": {"sentiment": "negative", "intent": "no"},
+    "later": {"sentiment": "neutral", "intent": "later"},
+    "pos": {"sentiment": "positive", "intent": "yes"},
+}
+
 def _infer_intent(text: str) -> Dict[str, str]:
     t = text.strip().lower()
     if not t:
         return {"sentiment": "neutral", "intent": "unknown"}
 
-    if re.search(NEG_WORDS, t, flags=re.I):
-        return {"sentiment": "negative", "intent": "no"}
-    if re.search(LATER_WORDS, t, flags=re.I):
-        return {"sentiment": "neutral", "intent": "later"}
-    if re.search(POS_WORDS, t, flags=re.I):
-        return {"sentiment": "positive", "intent": "yes"}
+    # Precedence is neg > later > pos regardless of position in the text
+    found = set()
+    for m in _INTENT_RE.finditer(t):
+        if m.lastgroup == "neg":
+            return dict(_INTENT_RESULTS["neg"])
+        found.add(m.lastgroup)
+    for group in ("later", "pos"):
+        if group in found:
+            return dict(_INTENT_RESULTS[group])
 
     # naive sentiment
-    pos = len(re.findall(r"\b(good|great|thanks|thank you|helpful|love)\b", t))
-    neg = len(re.findall(r"\b(bad|hate|terrible|annoyed|spam)\b", t))
+    pos = len(_POS_SENTIMENT_RE.findall(t))
+    neg = len(_NEG_SENTIMENT_RE.findall(t))
     sentiment = "positive" if pos > neg else "negative" if neg > pos else "neutral"
     return {"sentiment": sentiment, "intent": "unknown"}
 
@@ -99,17 +120,24 @@ def _infer_intent(text: str) -> Dict[str, str]:
 # Google Meet Scheduling (Calendar API with service account or graceful fallback)
 # --------------------------------------------------------------------------------------
 
+_CALENDAR_SERVICE: Optional[Any] = None
+_calendar_lock = threading.Lock()
+
 def _google_calendar_build() -> Optional[Any]:
     """
     Returns a Calendar service client if environment is configured, else None.
+    The built service is cached for the life of the process.
 
     Required env:
       - GOOGLE_SERVICE_ACCOUNT_JSON (path to service account JSON) OR raw JSON in GOOGLE_SERVICE_ACCOUNT_INFO
       - (optional) GOOGLE_IMPERSONATE_EMAIL (user to impersonate for Calendar)
     The service account must have domain-wide delegation enabled if impersonating.
     """
+    global _CALENDAR_SERVICE
     if not _GOOGLE_OK:
         return None
+    if _CALENDAR_SERVICE is not None:
+        return _CALENDAR_SERVICE
 
     info_path = os.getenv("GOOGLE_SERVICE_ACCOUNT_JSON")
     info_raw = os.getenv("GOOGLE_SERVICE_ACCOUNT_INFO")
@@ -132,11 +160,57 @@ def _google_calendar_build() -> Optional[Any]:
         if impersonate:
             creds = creds.with_subject(impersonate)
 
-        service = build("calendar", "v3", credentials=creds, cache_discovery=False)
-        return service
+        with _calendar_lock:
+            if _CALENDAR_SERVICE is None:
+                _CALENDAR_SERVICE = build("calendar", "v3", credentials=creds, cache_discovery=False)
+        return _CALENDAR_SERVICE
     except Exception:
         return None
 
+# 3.11+ fromisoformat accepts a trailing "Z" and the other ISO 8601 forms natively
+_FROMISO_HANDLES_Z = sys.version_info >= (3, 11)
+
+@lru_cache(maxsize=64)
+def _tz(name: str) -> Optional[tzinfo]:
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        return None
+
+def _parse_start(start_iso: str, timezone_str: str) -> datetime:
+    """
+    Parse an ISO 8601 start time; naive values are taken to be in timezone_str.
+    Raises ValueError on malformed input.
+    """
+    s = (start_iso or "").strip()
+    if not _FROMISO_HANDLES_Z and s.endswith(("Z", "z")):
+        s = s[:-1] + "+00:00"
+    dt = datetime.fromisoformat(s)
+    if dt.tzinfo is None:
+        tz = _tz(timezone_str)
+        if tz is not None:
+            dt = dt.replace(tzinfo=tz)
+    return dt
+
+# Shared, never mutated: only the per-event fields are built per call
+_CONF_SOLUTION_KEY = {"type": "hangoutsMeet"}
+
+def _meet_event_body(
+    title: str,
+    start_dt: datetime,
+    end_dt: datetime,
+    timezone_str: str,
+    attendees_emails: List[str],
+) -> Dict[str, Any]:
+    attendees = [{"email": safe} for safe in map(_safe_email, attendees_emails) if safe]
+    return {
+        "summary": title or "Intro chat",
+        "start": {"dateTime": start_dt.isoformat(), "timeZone": timezone_str},
+        "end": {"dateTime": end_dt.isoformat(), "timeZone": timezone_str},
+        "conferenceData": {"createRequest": {"requestId": uuid.uuid4().hex, "conferenceSolutionKey": _CONF_SOLUTION_KEY}},
+        "attendees": attendees,
+    }
+
 def _create_google_meet_event(
     title: str,
     start_iso: str,
@@ -148,29 +222,18 @@ def _create_google_meet_event(
     Tries to create a Calendar event with a Meet link.
     Returns { ok, meetUrl, eventId, calendarId, raw }.
     Falls back to a placeholder meetUrl if API is unavailable.
+    Raises ValueError if start_iso is not a valid ISO 8601 datetime.
     """
+    start_dt = _parse_start(start_iso, timezone_str)
     service = _google_calendar_build()
-    start_dt = datetime.fromisoformat(start_iso.replace("Z", "+00:00"))
     end_dt = start_dt + timedelta(minutes=max(15, duration_mins or 30))
 
     if service is None:
         # Fallback: not configured — return a fake-but-stable meet URL token so the flow continues.
-        fake_url = f"https://meet.google.com/{uuid.uuid4().hex[:3]}-{uuid.uuid4().hex[4:7]}-{uuid.uuid4().hex[8:12]}"
+        fake_url = _fake_meet_url()
         return {"ok": True, "meetUrl": fake_url, "eventId": None, "calendarId": None, "raw": None, "note": "Fallback (no Google API configured)"}
 
-    attendees = []
-    for e in attendees_emails:
-        safe = _safe_email(e)
-        if safe:
-            attendees.append({"email": safe})
-
-    event = {
-        "summary": title or "Intro chat",
-        "start": {"dateTime": start_dt.isoformat(), "timeZone": timezone_str},
-        "end": {"dateTime": end_dt.isoformat(), "timeZone": timezone_str},
-        "conferenceData": {"createRequest": {"requestId": uuid.uuid4().hex, "conferenceSolutionKey": {"type": "hangoutsMeet"}}},
-        "attendees": attendees,
-    }
+    event = _meet_event_body(title, start_dt, end_dt, timezone_str, attendees_emails)
 
     try:
         created = service.events().insert(calendarId="primary", body=event, conferenceDataVersion=1).execute()
@@ -194,6 +257,6 @@ def _create_google_meet_event(
         }
     except Exception as e:
         # Fallback on API failure
-        fake_url = f"https://meet.google.com/{uuid.uuid4().hex[:3]}-{uuid.uuid4().hex[4:7]}-{uuid.uuid4().hex[8:12]}"
+        fake_url = _fake_meet_url()
         return {"ok": False, "meetUrl": fake_url, "error": str(e), "eventId": None, "calendarId": None, "raw": None}
 
@@ -0,0 +1,153 @@
+# common.py
+from __future__ import annotations
+
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Iterator, Tuple
+
+import firebase_admin
+from firebase_admin import auth, credentials, firestore
+
+# orjson (Rust) when available; stdlib json otherwise
+try:
+    import orjson as _orjson
+except Exception:
+    _orjson = None
+
+# ------------------------------------------------------------------------------
+# Logging (I/O off the request thread)
+# ------------------------------------------------------------------------------
+# Request threads only enqueue records; a QueueListener thread writes stderr.
+# Modules log through logger.getChild(...); LOG_LEVEL=DEBUG for request traces.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+logger = logging.getLogger("neuro")
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_queue = logging.handlers.QueueHandler(queue.SimpleQueue())
+_log_listener = None
+
+def _start_log_listener() -> None:
+    """
+    Fresh queue + writer thread for this process. Threads don't survive fork,
+    so gunicorn workers forked from a preloaded master call this again.
+    """
+    global _log_listener
+    q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    _log_queue.queue = q
+    _log_listener = logging.handlers.QueueListener(q, _log_stream, respect_handler_level=True)
+    _log_listener.start()
+
+def _stop_log_listener() -> None:
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()  # drains what is still queued
+        _log_listener = None
+
+def _init_logging() -> None:
+    if logger.handlers:
+        return
+    _start_log_listener()
+    atexit.register(_stop_log_listener)
+    os.register_at_fork(after_in_child=_start_log_listener)
+    logger.addHandler(_log_queue)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+_init_logging()
+
+# ------------------------------------------------------------------------------
+# Firebase / Firestore init (once per process)
+# ------------------------------------------------------------------------------
+SERVICE_ACCOUNT_PATH = os.getenv(
+    "GOOGLE_APPLICATION_CREDENTIALS",
+    "neru-b3128-firebase-adminsdk-fbsvc-11110f3ad3.json",
+)
+
+def ensure_firebase() -> None:
+    if not firebase_admin._apps:
+        cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
+        firebase_admin.initialize_app(cred)
+
+@lru_cache(maxsize=1)
+def get_db() -> firestore.Client:
+    """The process-wide Firestore client (initializes Firebase on first use)."""
+    ensure_firebase()
+    return firestore.client()
+
+def stream_paged(query, page_size: int = 500) -> Iterator[Any]:
+    """
+    Every doc matched by `query`, read in __name__-ordered pages chained with
+    start_after cursors: no single long-lived stream to time out on a large
+    collection, and no offset re-reads.
+    """
+    page = query.order_by("__name__").limit(page_size)
+    while True:
+        docs = list(page.stream())
+        yield from docs
+        if len(docs) < page_size:
+            return
+        page = query.order_by("__name__").limit(page_size).start_after(docs[-1])
+
+# ------------------------------------------------------------------------------
+# Firebase ID token verification (cached)
+# ------------------------------------------------------------------------------
+# Verified claims keyed by blake2b(token); reused until shortly before `exp`
+TOKEN_CACHE_MAX = 10_000
+TOKEN_EXP_MARGIN_SECONDS = 30
+_token_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+def _token_key(id_token: str) -> str:
+    return hashlib.blake2b(id_token.encode("utf-8"), digest_size=16).hexdigest()
+
+def verify_id_token(id_token: str) -> Dict[str, Any]:
+    """
+    Drop-in for firebase_admin.auth.verify_id_token with a per-process cache.
+    Raises whatever the SDK raises on an invalid token (failures are not cached).
+    """
+    key = _token_key(id_token)
+    now = time.time()
+    with _token_cache_lock:
+        hit = _token_cache.get(key)
+        if hit:
+            valid_until, claims = hit
+            if now < valid_until:
+                _token_cache.move_to_end(key)
+                return claims
+            del _token_cache[key]
+
+    claims = auth.verify_id_token(id_token)
+
+    valid_until = float(claims.get("exp") or 0) - TOKEN_EXP_MARGIN_SECONDS
+    if valid_until > now:
+        with _token_cache_lock:
+            _token_cache[key] = (valid_until, claims)
+            _token_cache.move_to_end(key)
+            while len(_token_cache) > TOKEN_CACHE_MAX:
+                _token_cache.popitem(last=False)
+    return claims
+
+# ------------------------------------------------------------------------------
+# Conversations
+# ------------------------------------------------------------------------------
+def conv_id_for(a: str, b: str) -> str:
+    """Deterministic 2-user conversation id (order-independent)."""
+    return f"{a}__{b}" if a <= b else f"{b}__{a}"
+
+# ------------------------------------------------------------------------------
+# JSON encoding
+# ------------------------------------------------------------------------------
+def dumps_json(obj: Any) -> bytes:
+    """Serialize to UTF-8 JSON bytes; unknown types fall back to str()."""
+    if _orjson is not None:
+        return _orjson.dumps(obj, default=str)
+    return json.dumps(obj, default=str, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
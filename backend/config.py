@@ -1,15 +1,17 @@
 # app.py
 from __future__ import annotations
 import datetime
+from collections import OrderedDict
 from typing import List
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import firebase_admin
-from firebase_admin import credentials, firestore
+from werkzeug.routing import BaseConverter
+from firebase_admin import firestore
 import os
 
-import base64, io, numpy as np
+import base64, io, json, random, threading, time, zlib, numpy as np
 from pyparsing import Any, Dict, Optional
 
 import network
@@ -28,27 +30,122 @@ from datetime import datetime, timezone
 import github_integration as github
 
 import ai
+from common import conv_id_for, dumps_json, get_db, logger, stream_paged
+
+# orjson (Rust) when available; Flask's stdlib-json provider otherwise
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+# Response compression (br/gzip by Accept-Encoding) when Flask-Compress is installed
+try:
+    from flask_compress import Compress
+    _COMPRESS_OK = True
+except Exception:
+    _COMPRESS_OK = False
+
+# Firestore data bundles (google-cloud-firestore >= 2.1)
+try:
+    from google.cloud.firestore_bundle import FirestoreBundle
+    _BUNDLE_OK = True
+except Exception:
+    _BUNDLE_OK = False
 
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:3000")
+log = logger.getChild("api")
 
-SERVICE_ACCOUNT_PATH = os.getenv(
-    "GOOGLE_APPLICATION_CREDENTIALS",
-    "neru-b3128-firebase-adminsdk-fbsvc-11110f3ad3.json",
-)
-
-if not firebase_admin._apps:
-    cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
-    firebase_admin.initialize_app(cred)
+db = get_db()
 
-db = firestore.client()
+# Long-lived collection references (path objects; cheap to share across threads)
+POSTS = db.collection("posts")
+USERS = db.collection("users")
+CONVERSATIONS = db.collection("conversations")
 
 # app = Flask(__name__)
 # CORS(app, resources={r"/*": {"origins": CORS_ORIGINS}})
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    jsonify()/get_json() through orjson. Datetimes are passed through to
+    Flask's default() so they keep the same wire format as before.
+    """
+    _OPTIONS = (
+        (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME)
+        if orjson is not None else 0
+    )
+
+    def _dumps_bytes(self, obj: Any) -> bytes:
+        return orjson.dumps(obj, default=self.default, option=self._OPTIONS)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return self._dumps_bytes(obj).decode("utf-8")
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
+
+class SlugConverter(BaseConverter):
+    """
+    <slug:...> URL segments: kebab-case slugs (see profiles.kebab_any), lowercased
+    once at routing. Anything else 404s before a handler (or a Firestore query) runs.
+    """
+    regex = r"[A-Za-z0-9][A-Za-z0-9-]*"
+
+    def to_python(self, value: str) -> str:
+        return value.lower()
+
 app = Flask(__name__)
+app.url_map.converters["slug"] = SlugConverter
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+# JSON shrinks 5-10x; brotli 4 compresses better than gzip 6 at similar CPU.
+# Streamed bodies are left alone here (Flask-Compress would buffer them, and SSE
+# must not be): /api/posts gzips its own stream, see _gzip_stream.
+COMPRESS_GZIP_LEVEL = 6
+app.config.update(
+    COMPRESS_ALGORITHM=["br", "gzip"],
+    COMPRESS_BR_LEVEL=4,
+    COMPRESS_LEVEL=COMPRESS_GZIP_LEVEL,
+    COMPRESS_MIN_SIZE=512,
+    COMPRESS_MIMETYPES=["application/json", "application/octet-stream"],
+    COMPRESS_STREAMS=False,
+)
+if _COMPRESS_OK:
+    Compress(app)
 CORS(app, resources={r"/*": {"origins": CORS_ORIGINS,
                              "allow_headers": ["Content-Type", "Authorization"],
                              "methods": ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]}})
 
+# ------------------------------------------------------------------------------
+# Auth: the Bearer token is verified once per request (cached, see
+# common.verify_id_token) in a before_request hook; handlers read g.uid.
+# ------------------------------------------------------------------------------
+# Endpoints that 401 without a valid token
+AUTH_REQUIRED = frozenset({
+    "api_follow", "api_follow_bulk", "api_unfollow", "api_me", "api_profile_me", "update_profile_about",
+    "api_update_my_experience", "api_delete_my_experience",
+    "api_msg_send", "api_msg_thread", "api_msg_partners", "api_msg_seed_demo",
+    "create_post", "like_post",
+})
+# Endpoints that work signed out but personalize when a token is sent
+AUTH_OPTIONAL = frozenset({"fetch_posts", "get_profile_about"})
+
+@app.before_request
+def _resolve_uid():
+    g.uid = None
+    if request.method == "OPTIONS":
+        return None
+    endpoint = request.endpoint
+    if endpoint not in AUTH_REQUIRED and endpoint not in AUTH_OPTIONAL:
+        return None
+    g.uid = profiles.verify_bearer_uid(request.headers.get("Authorization"))
+    if not g.uid and endpoint in AUTH_REQUIRED:
+        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    return None
+
 @app.get("/")
 def health():
     return jsonify({"ok": True, "service": "profiles-api"})
@@ -63,13 +160,11 @@ def api_search_users():
     items = search_users(q, limit=limit)
     return jsonify({"items": items})
 
-@app.post("/api/users/<slug>/follow")
+@app.post("/api/users/<slug:slug>/follow")
 def api_follow(slug: str):
-    uid = profiles.verify_bearer_uid(request.headers.get("Authorization"))
-    if not uid:
-        return jsonify({"error": "unauthorized"}), 401
+    uid = g.uid
     try:
-        result = profiles.follow_user(uid, slug.lower())
+        result = profiles.follow_user(uid, slug)
         return jsonify(result)
     except LookupError:
         return jsonify({"error": "not found"}), 404
@@ -78,13 +173,31 @@ def api_follow(slug: str):
     except Exception as e:
         return jsonify({"error": "internal"}), 500
 
-@app.post("/api/users/<slug>/unfollow")
+# Most uids one bulk-follow request may carry
+FOLLOW_BULK_MAX = 500
+
+@app.post("/api/follow/bulk")
+def api_follow_bulk():
+    """POST body: { "uids": ["<uid>", ...] } -> { "added": <new follows> }"""
+    uid = g.uid
+    body = request.get_json(silent=True) or {}
+    uids = body.get("uids")
+    if not isinstance(uids, list) or not all(isinstance(u, str) for u in uids):
+        return jsonify({"error": "uids must be a list of strings"}), 400
+    if len(uids) > FOLLOW_BULK_MAX:
+        return jsonify({"error": f"at most {FOLLOW_BULK_MAX} uids per request"}), 400
+    try:
+        return jsonify({"added": profiles.follow_users_bulk(uid, uids)})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": "internal"}), 500
+
+@app.post("/api/users/<slug:slug>/unfollow")
 def api_unfollow(slug: str):
-    uid = profiles.verify_bearer_uid(request.headers.get("Authorization"))
-    if not uid:
-        return jsonify({"error": "unauthorized"}), 401
+    uid = g.uid
     try:
-        result = profiles.unfollow_user(uid, slug.lower())
+        result = profiles.unfollow_user(uid, slug)
         return jsonify(result)
     except LookupError:
         return jsonify({"error": "not found"}), 404
@@ -95,23 +208,21 @@ def api_unfollow(slug: str):
 
 @app.get("/api/me")
 def api_me():
-    uid = profiles.verify_bearer_uid(request.headers.get("Authorization"))
-    if not uid:
-        return jsonify({"error": "unauthorized"}), 401
+    uid = g.uid
 
-    user = profiles.get_user_by_uid(uid)
+    user = profiles.get_user_by_uid(uid, profiles.PROFILE_FIELDS)
     if not user:
         return jsonify({"error": "not found"}), 404
 
-    user = profiles.ensure_user_slug(uid, user)
+    user = profiles.ensure_user_slug(uid, profiles.with_follower_stats(uid, user))
     return jsonify(user)
 
-@app.get("/api/users/<slug>")
+@app.get("/api/users/<slug:slug>")
 def api_user_by_slug(slug: str):
     user = profiles.get_user_by_slug(slug)
     if not user:
         return jsonify({"error": "not found", "code": "USER_NOT_FOUND"}), 404
-    return jsonify(user)
+    return jsonify(profiles.with_follower_stats(user["id"], user))
 
 @app.post("/api/admin/backfill-slugs")
 def admin_backfill_slugs():
@@ -123,13 +234,20 @@ def admin_backfill_slugs():
     updated = profiles.backfill_all_slugs()
     return jsonify({"updated": updated})
 
+# What a client may set on users/{uid}; counters, follow state and the derived
+# search/slug fields (slugAliases, nameTokens, ...) are owned by the server
+_UPSERT_KEYS = (
+    "firstName", "lastName", "fullName", "email", "slug", "avatarUrl",
+    "headline", "occupation", "location", "bio", "interests", "skills", "tags", "topics",
+)
+
 @app.post("/api/admin/upsert-user")
 def admin_upsert_user():
     body = request.get_json(force=True, silent=True) or {}
     uid = body.get("uid")
     if not uid:
         return jsonify({"error": "uid required"}), 400
-    data = {k: v for k, v in body.items() if k != "uid"}
+    data = {k: body[k] for k in _UPSERT_KEYS if k in body}
     user = profiles.upsert_user(uid, data)
     return jsonify(user)
 
@@ -139,7 +257,6 @@ def enroll_face():
     uid = data.get("user_id")
     frames = data.get("frames", [])
 
-    print(f"[enroll_face] Received enrollment for uid: {uid} with {len(frames)} frames")  # LOG
 
     result = save_face_enrollment(uid, frames)
     return jsonify(result), (200 if result.get("ok") else 400)
@@ -158,10 +275,10 @@ def recognize_face():
         return jsonify({"ok": False, "error": str(e)}), 500
 
 
-@app.get("/api/users/<slug>/experience")
+@app.get("/api/users/<slug:slug>/experience")
 def api_list_experience(slug: str):
     try:
-        items = profiles.list_experience_for_slug(slug.lower().strip())
+        items = profiles.list_experience_for_slug(slug)
         return jsonify({"ok": True, "items": items})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
@@ -184,10 +301,7 @@ def api_add_my_experience():
 @app.put("/api/me/experience/<exp_id>")
 @app.patch("/api/me/experience/<exp_id>")
 def api_update_my_experience(exp_id: str):
-    authz = request.headers.get("Authorization")
-    uid = profiles.verify_bearer_uid(authz)
-    if not uid:
-        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    uid = g.uid
     payload = request.get_json(silent=True) or {}
     clean, err = profiles._validate_and_canonicalize_experience_input(payload)
     if err:
@@ -199,75 +313,63 @@ def api_update_my_experience(exp_id: str):
 
 @app.delete("/api/me/experience/<exp_id>")
 def api_delete_my_experience(exp_id: str):
-    authz = request.headers.get("Authorization")
-    uid = profiles.verify_bearer_uid(authz)
-    if not uid:
-        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    uid = g.uid
     ref = profiles._experience_collection(uid).document(exp_id)
     ref.delete()
     return jsonify({"ok": True})
 
 @app.get("/api/profile/me")
 def api_profile_me():
-    uid = profiles.verify_bearer_uid(request.headers.get('Authorization'))
-    if not uid:
-        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    uid = g.uid
     
     user = profiles.get_user_by_uid(uid)
     if not user:
         return jsonify({"ok": False, "error": "not found"}), 404
     
-    user = profiles.ensure_user_slug(uid, user)
+    user = profiles.ensure_user_slug(uid, profiles.with_follower_stats(uid, user))
     return jsonify({"ok": True, "profile": user}), 200
 
-@app.get("/api/profile/by-slug/<slug>")
+@app.get("/api/profile/by-slug/<slug:slug>")
 def api_profile_by_slug(slug: str):
-    user = profiles.get_user_by_slug(slug or "")
+    user = profiles.get_user_by_slug(slug)
     if not user:
         return jsonify({"ok": False, "error": "not found"}), 404
-    return jsonify({"ok": True, "profile": user}), 200
+    return jsonify({"ok": True, "profile": profiles.with_follower_stats(user["id"], user)}), 200
+
+ABOUT_FIELDS = ("title", "bio", "currentFocus", "beyondWork")
 
 @app.post("/api/profile/about")
 def update_profile_about():
-    auth_header = request.headers.get("Authorization")
-    uid = profiles.verify_bearer_uid(auth_header)
-    if not uid:
-        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    uid = g.uid
 
     data = request.get_json(silent=True) or {}
-    about = {
-        "title": data.get("title", "").strip(),
-        "bio": data.get("bio", "").strip(),
-        "currentFocus": data.get("currentFocus", "").strip(),
-        "beyondWork": data.get("beyondWork", "").strip(),
-    }
+    about = {k: (data.get(k) or "").strip() for k in ABOUT_FIELDS}
 
     # Save into Firestore as a sub-document
     profiles._get_user_doc(uid).collection("about").document("main").set(about, merge=True)
 
     return jsonify({"ok": True, "about": about}), 200
 
-@app.get("/api/profile/about/<slug>")
+@app.get("/api/profile/about/<slug:slug>")
 def get_profile_about(slug: str):
     try:
-        user = profiles.get_user_by_slug(slug)
-        if not user:
-            return jsonify({"ok": False, "error": "not found"}), 404
-
-        uid = user["id"]
-        doc = profiles._get_user_doc(uid).collection("about").document("main").get()
-        about = doc.to_dict() if doc.exists else {}
-
-        return jsonify({"ok": True, "about": about, "uid": uid}), 200
+        # Own profile: the viewer's slug (cached, projected read) skips the slug lookup
+        uid = g.uid
+        me = profiles.get_user_by_uid(uid, ["slug"]) if uid else None
+        if not me or (me.get("slug") or "").lower() != slug:
+            user = profiles.get_user_by_slug(slug)
+            if not user:
+                return jsonify({"ok": False, "error": "not found"}), 404
+            uid = user["id"]
+
+        return jsonify({"ok": True, "about": profiles.get_about(uid), "uid": uid}), 200
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
     
 @app.post("/api/messages/send")
 def api_msg_send():
     """POST body: { "to": "<otherUid>", "text": "<message>" }"""
-    uid = profiles.verify_bearer_uid(request.headers.get("Authorization"))
-    if not uid:
-        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    uid = g.uid
 
     body = request.get_json(force=True, silent=True) or {}
     to_uid = (body.get("to") or "").strip()
@@ -289,9 +391,7 @@ def api_msg_send():
 @app.get("/api/messages/with/<other_uid>")
 def api_msg_thread(other_uid: str):
     """Retrieve the 2-party conversation with <other_uid>."""
-    uid = profiles.verify_bearer_uid(request.headers.get("Authorization"))
-    if not uid:
-        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    uid = g.uid
 
     try:
         res = msgs.get_thread(uid, other_uid)
@@ -307,9 +407,7 @@ def api_msg_thread(other_uid: str):
 @app.get("/api/messages/partners")
 def api_msg_partners():
     """List UIDs the requester has conversations with."""
-    uid = profiles.verify_bearer_uid(request.headers.get("Authorization"))
-    if not uid:
-        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    uid = g.uid
 
     try:
         res = msgs.list_partners(uid)
@@ -326,9 +424,7 @@ def api_msg_seed_demo():
     Dev utility to seed a tiny back-and-forth:
     POST body: { "a": "<uidA>", "b": "<uidB>" }
     """
-    uid = profiles.verify_bearer_uid(request.headers.get("Authorization"))
-    if not uid:
-        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    uid = g.uid
 
     body = request.get_json(force=True, silent=True) or {}
     a = (body.get("a") or "").strip()
@@ -350,7 +446,7 @@ def api_profile_by_uid(uid: str):
     if not user:
         return jsonify({"ok": False, "error": "not found"}), 404
     # Ensure slug is present/consistent like elsewhere
-    user = profiles.ensure_user_slug(uid, user)
+    user = profiles.ensure_user_slug(uid, profiles.with_follower_stats(uid, user))
     return jsonify({"ok": True, "profile": user}), 200
 
 @app.route("/api/ai/suggest-reply", methods=["POST"])
@@ -362,55 +458,101 @@ def suggest_reply():
     """
     try:
         me_uid = ai._require_auth()
-        print(f"[AI] Request from uid={me_uid}")
-
         ai._rate_limit(me_uid)
 
         body = request.get_json(silent=True) or {}
         partner_uid = (body.get("partnerUid") or "").strip()
-        print(f"[AI] partnerUid={partner_uid!r}, body={body}")
 
         if not partner_uid:
             return jsonify({"ok": False, "error": "Missing partnerUid"}), 400
 
-        conv_id = ai._conv_id_for(me_uid, partner_uid)
+        conv_id = conv_id_for(me_uid, partner_uid)
         msgs = ai._fetch_last_messages(conv_id, ai.MAX_MSGS)
-        print(f"[AI] conv_id={conv_id}, fetched {len(msgs)} msgs")
 
-        prompt = ai._build_prompt(msgs, me_uid)
-        print(f"[AI] prompt built (len={len(prompt)})")
+        # Same tail -> same suggestion; skip prompt building and Gemini entirely
+        cache_key = (me_uid, partner_uid, ai._messages_sig(msgs))
+        reply = ai._reply_cache_get(cache_key)
+        if reply is None:
+            prompt = ai._build_prompt(msgs, me_uid)
+            reply = ai._call_gemini(prompt, ai.REPLY_INSTRUCTIONS, cache_scope=f"{me_uid}/{partner_uid}")
+            ai._reply_cache_put(cache_key, reply)
+
+        resp = jsonify({"ok": True, "reply": reply})
+        resp.headers["Cache-Control"] = "private, max-age=60"
+        return resp
 
-        reply = ai._call_gemini(prompt)
-        print(f"[AI] Gemini reply: {reply!r}")
+    except PermissionError as e:
+        log.warning("suggest-reply permission error: %s", e)
+        return jsonify({"ok": False, "error": str(e)}), 401
+    except RuntimeError as e:
+        log.warning("suggest-reply runtime error: %s", e)
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        log.exception("suggest-reply unexpected error: %s: %s", type(e).__name__, e)
+        return jsonify({"ok": False, "error": "Internal error"}), 500
+
+@app.route("/api/ai/suggest-reply/stream", methods=["POST"])
+def suggest_reply_stream():
+    """
+    POST /api/ai/suggest-reply/stream
+    Same input as /api/ai/suggest-reply, answered as Server-Sent Events:
+      data: {"delta": "..."}                  (repeated)
+      data: {"done": true, "reply": "..."}     (last)
+      event: error / data: {"error": "..."}    (on failure mid-stream)
+    """
+    try:
+        me_uid = ai._require_auth()
+        ai._rate_limit(me_uid)
 
-        return jsonify({"ok": True, "reply": reply})
+        body = request.get_json(silent=True) or {}
+        partner_uid = (body.get("partnerUid") or "").strip()
+        if not partner_uid:
+            return jsonify({"ok": False, "error": "Missing partnerUid"}), 400
+        # Fail before the 200 goes out; inside the stream it could only be an SSE error
+        if not ai.GOOGLE_API_KEY:
+            raise RuntimeError("GOOGLE_API_KEY environment variable is not set")
 
+        conv_id = conv_id_for(me_uid, partner_uid)
+        msgs = ai._fetch_last_messages(conv_id, ai.MAX_MSGS)
+        prompt = ai._build_prompt(msgs, me_uid)
+        cache_scope = f"{me_uid}/{partner_uid}"
     except PermissionError as e:
-        print(f"[AI] Permission error: {e}")
+        log.warning("suggest-reply-stream permission error: %s", e)
         return jsonify({"ok": False, "error": str(e)}), 401
     except RuntimeError as e:
-        print(f"[AI] Runtime error: {e}")
+        log.warning("suggest-reply-stream runtime error: %s", e)
         return jsonify({"ok": False, "error": str(e)}), 400
     except Exception as e:
-        import traceback
-        print(f"[AI] Unexpected error: {type(e).__name__}: {e}")
-        traceback.print_exc()
+        log.exception("suggest-reply-stream unexpected error: %s: %s", type(e).__name__, e)
         return jsonify({"ok": False, "error": "Internal error"}), 500
 
+    def events():
+        parts = []
+        try:
+            for delta in ai._call_gemini_stream(prompt, ai.REPLY_INSTRUCTIONS, cache_scope):
+                parts.append(delta)
+                yield f"data: {json.dumps({'delta': delta})}\n\n"
+            yield f"data: {json.dumps({'done': True, 'reply': ''.join(parts).strip()})}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.route('/api/posts', methods=["POST"])
 def create_post():
-    auth_header = request.headers.get('Authorization')
-    uid = profiles.verify_bearer_uid(auth_header)
-    if not uid:
-        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    uid = g.uid
 
     text = request.form.get("text", '').strip()
 
     media_url = None
     media_type = None
 
-    doc_ref = db.collection('users').document(uid).get()
-    data = doc_ref.to_dict()
+    doc_ref = USERS.document(uid).get(field_paths=['fullName'])
+    data = doc_ref.to_dict() or {}
 
     post = {
         'userId':uid,
@@ -419,77 +561,279 @@ def create_post():
         'mediaUrl':media_url,
         'mediaType':media_type,
         'createdAt':firestore.SERVER_TIMESTAMP,
-        'likes':[],
         'commentsCount':0
     }
 
-    doc_ref = db.collection('posts').document()
+    doc_ref = POSTS.document()
     doc_ref.set(post)
 
     saved_post = doc_ref.get().to_dict()
     saved_post["id"] = doc_ref.id
+    saved_post["likeCount"] = 0
+    saved_post["likedByMe"] = False
 
     return jsonify({"ok": True, "post": saved_post})
 
+POSTS_PAGE_SIZE = 20
+POSTS_MAX_PAGE_SIZE = 100
+# 'likes' is the legacy inline liker array, still read for older posts
+POST_FIELDS = ['userId', 'userFullName', 'text', 'mediaUrl', 'mediaType', 'createdAt', 'likes', 'commentsCount']
+
+# Likes live in posts/{id}/likes/{uid}; the count is spread over N counter
+# shards (posts/{id}/counters/{0..N-1}) so hot posts are not capped by the
+# one-write-per-second limit of a single document. The post doc itself is never
+# written by a like.
+LIKE_SHARDS = 10
+
+# post id -> (stored_at, shard total): a feed page sums LIKE_SHARDS docs per post,
+# so share those sums across requests for a few seconds
+LIKE_COUNT_TTL_SECONDS = 15.0
+LIKE_COUNT_CACHE_MAX = 10_000
+_like_count_cache: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+_like_count_lock = threading.Lock()
+
+def _like_stats(post_refs, viewer_uid: Optional[str]):
+    """
+    One get_all for the viewer's like docs plus the shards of every post whose
+    total is not cached. Returns (shard totals by post id, liked post ids).
+    """
+    now = time.time()
+    counts: Dict[str, int] = {}
+    refs = []
+    with _like_count_lock:
+        for ref in post_refs:
+            hit = _like_count_cache.get(ref.id)
+            if hit and now - hit[0] <= LIKE_COUNT_TTL_SECONDS:
+                counts[ref.id] = hit[1]
+            else:
+                counts[ref.id] = 0
+                refs.extend(ref.collection("counters").document(str(i)) for i in range(LIKE_SHARDS))
+    fresh = {r.parent.parent.id for r in refs}
+    if viewer_uid:
+        refs.extend(ref.collection("likes").document(viewer_uid) for ref in post_refs)
+
+    liked = set()
+    if not refs:
+        return counts, liked
+    for snap in db.get_all(refs):
+        if not snap.exists:
+            continue
+        post_id = snap.reference.parent.parent.id
+        if snap.reference.parent.id == "counters":
+            counts[post_id] += int((snap.to_dict() or {}).get("likes") or 0)
+        else:
+            liked.add(post_id)
+
+    with _like_count_lock:
+        for post_id in fresh:
+            _like_count_cache[post_id] = (now, counts[post_id])
+            _like_count_cache.move_to_end(post_id)
+        while len(_like_count_cache) > LIKE_COUNT_CACHE_MAX:
+            _like_count_cache.popitem(last=False)
+    return counts, liked
+
+@firestore.transactional
+def _tx_toggle_like(transaction, post_ref, uid: str) -> str:
+    """Only the viewer's like doc is read (and locked); the count goes to a random shard."""
+    like_ref = post_ref.collection("likes").document(uid)
+    like_snap = like_ref.get(transaction=transaction)
+    shard_ref = post_ref.collection("counters").document(str(random.randrange(LIKE_SHARDS)))
+    if like_snap.exists:
+        transaction.delete(like_ref)
+        transaction.set(shard_ref, {"likes": firestore.Increment(-1)}, merge=True)
+        return "unliked"
+    transaction.set(like_ref, {"at": firestore.SERVER_TIMESTAMP})
+    transaction.set(shard_ref, {"likes": firestore.Increment(1)}, merge=True)
+    return "liked"
+
+def _toggle_like(post_ref, uid: str) -> str:
+    # Plain (non-transactional) read: existence, plus the legacy inline array
+    post_snap = post_ref.get(field_paths=["likes"])
+    if not post_snap.exists:
+        raise LookupError("post not found")
+    try:
+        # Older posts keep their inline array until each of those likers toggles off
+        if uid in ((post_snap.to_dict() or {}).get("likes") or []):
+            post_ref.update({"likes": firestore.ArrayRemove([uid])})
+            return "unliked"
+        return _tx_toggle_like(db.transaction(), post_ref, uid)
+    finally:
+        with _like_count_lock:
+            _like_count_cache.pop(post_ref.id, None)
+
+def _gzip_stream(chunks):
+    """gzip a streamed body chunk by chunk (brotli has no good incremental story here)."""
+    z = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
 @app.route('/api/posts', methods=['GET'])
 def fetch_posts():
+    """
+    GET /api/posts?userId=<uid>&limit=20&after=<cursor>
+    Newest first, keyset-paginated on (createdAt, id) so posts sharing a timestamp
+    are neither skipped nor repeated. `nextCursor` ("<ISO createdAt>|<id>" of the
+    last post on a full page) goes back as `after`, else null.
+    Each post carries `likeCount`, and `likedByMe` when a Bearer token is sent.
+    Filtering by userId needs the composite index in firestore.indexes.json.
+    Posts without createdAt are not returned until backfill_post_created_at runs.
+    """
     try:
-        user_id = request.args.get("userId")
-        post_ref = db.collection('posts')
+        limit = int(request.args.get("limit") or POSTS_PAGE_SIZE)
+    except Exception:
+        limit = POSTS_PAGE_SIZE
+    limit = max(1, min(limit, POSTS_MAX_PAGE_SIZE))
 
+    after = (request.args.get("after") or "").strip()
+    after_iso, _, after_id = after.partition("|")
+    try:
+        after_dt = datetime.fromisoformat(after_iso) if after else None
+    except ValueError:
+        return jsonify({"ok": False, "error": "invalid 'after' cursor"}), 400
+
+    viewer_uid = g.uid
+
+    try:
+        user_id = request.args.get("userId")
+        q = POSTS.select(POST_FIELDS)
         if user_id:
-            docs = post_ref.where("userId", "==", user_id).stream()
-        else:
-            docs = post_ref.stream()
+            q = q.where("userId", "==", user_id)
+        q = (q.order_by("createdAt", direction=firestore.Query.DESCENDING)
+              .order_by("__name__", direction=firestore.Query.DESCENDING))
+        if after_dt:
+            # Older cursors carry only the timestamp: a one-value cursor is a valid prefix
+            cursor: List[Any] = [after_dt]
+            if after_id:
+                cursor.append(POSTS.document(after_id))
+            q = q.start_after(cursor)
+
+        docs = list(q.limit(limit).stream())
+        like_counts, liked = _like_stats([d.reference for d in docs], viewer_uid)
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
 
-        posts = []
+    def gen():
+        # Encode the JSON array doc-by-doc instead of building the whole body
+        yield b'{"ok":true,"posts":['
+        sep = b""
+        last_cursor = None
         for doc in docs:
-            data = doc.to_dict()
+            data = doc.to_dict() or {}
             data['id'] = doc.id
 
             created_at = data.get('createdAt')
             if created_at:
                 data["createdAt"] = created_at.isoformat()
+                last_cursor = f'{data["createdAt"]}|{doc.id}'
+
+            legacy_likes = data.pop("likes", None) or []
+            data["likeCount"] = like_counts.get(doc.id, 0) + len(legacy_likes)
+            data["likedByMe"] = doc.id in liked or (viewer_uid in legacy_likes if viewer_uid else False)
 
-            posts.append(data)
+            yield sep + dumps_json(data)
+            sep = b","
+        next_cursor = last_cursor if len(docs) == limit else None
+        yield b'],"nextCursor":' + dumps_json(next_cursor) + b'}'
 
-        return jsonify({"ok": True, "posts": posts}), 200
+    if "gzip" in (request.headers.get("Accept-Encoding") or ""):
+        return Response(stream_with_context(_gzip_stream(gen())), status=200, mimetype="application/json",
+                        headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+    return Response(stream_with_context(gen()), status=200, mimetype="application/json",
+                    headers={"Vary": "Accept-Encoding"})
+
+def backfill_post_created_at(batch_size: int = 400) -> int:
+    """
+    Stamp createdAt on posts saved without one (or with a non-timestamp value), using
+    the document's create time, so the feed's order_by("createdAt") includes them.
+    Returns the number updated.
+    """
+    updated = 0
+    batch = db.batch()
+    ops = 0
+    for snap in stream_paged(POSTS.select(["createdAt"])):
+        created_at = (snap.to_dict() or {}).get("createdAt")
+        if isinstance(created_at, datetime):
+            continue
+        try:
+            fixed = datetime.fromisoformat(created_at) if isinstance(created_at, str) else snap.create_time
+        except ValueError:
+            fixed = snap.create_time
+        batch.update(snap.reference, {"createdAt": fixed})
+        updated += 1
+        ops += 1
+        if ops >= batch_size:
+            batch.commit()
+            batch = db.batch()
+            ops = 0
+    if ops:
+        batch.commit()
+    return updated
+
+@app.post("/api/admin/backfill-post-dates")
+def admin_backfill_post_dates():
+    # Rewrites every post: only the ADMIN_UID account may run it (and nobody when unset)
+    admin_uid = os.getenv("ADMIN_UID")
+    uid = profiles.verify_bearer_uid(request.headers.get("Authorization"))
+    if not admin_uid or uid != admin_uid:
+        return jsonify({"error": "forbidden"}), 403
+    return jsonify({"updated": backfill_post_created_at()})
+
+# The first feed page as a Firestore bundle: the web SDK's loadBundle() seeds its
+# cache from it and namedQuery("latest-posts") answers without a Firestore read.
+# Built at most once per BUNDLE_TTL_SECONDS per process; the CDN shares it across sessions.
+BUNDLE_TTL_SECONDS = 60
+LATEST_POSTS_BUNDLE = "latest-posts"
+# The bundle is public and CDN-cached: ship only what a feed card shows, never
+# the legacy 'likes' array of liker uids
+BUNDLE_POST_FIELDS = [f for f in POST_FIELDS if f != "likes"]
+_bundle_cache: Dict[str, Any] = {"t": 0.0, "body": None}
+_bundle_lock = threading.Lock()
+
+def _latest_posts_bundle() -> bytes:
+    with _bundle_lock:
+        if _bundle_cache["body"] is not None and time.time() - _bundle_cache["t"] < BUNDLE_TTL_SECONDS:
+            return _bundle_cache["body"]
+        q = (POSTS.select(BUNDLE_POST_FIELDS)
+             .order_by("createdAt", direction=firestore.Query.DESCENDING)
+             .limit(POSTS_PAGE_SIZE))
+        bundle = FirestoreBundle(LATEST_POSTS_BUNDLE)
+        bundle.add_named_query(LATEST_POSTS_BUNDLE, q)
+        _bundle_cache["body"] = bundle.build().encode("utf-8")
+        _bundle_cache["t"] = time.time()
+        return _bundle_cache["body"]
+
+@app.get("/api/bundles/latest-posts")
+def latest_posts_bundle():
+    """Anonymous, shared feed snapshot (no likedByMe); signed-in reads keep using /api/posts."""
+    if not _BUNDLE_OK:
+        return jsonify({"ok": False, "error": "bundles unavailable"}), 501
+    try:
+        body = _latest_posts_bundle()
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
-    
+    return Response(body, status=200, mimetype="application/octet-stream", headers={
+        "Cache-Control": "public, max-age=30, stale-while-revalidate=300",
+    })
+
 @app.route('/api/posts/like', methods=['POST'])
 def like_post():
     try:
-        auth_header = request.headers.get("Authorization")
-        uid = profiles.verify_bearer_uid(auth_header)
-        if not uid:
-            return jsonify({"ok": False, "error": "unauthorized"}), 401
+        uid = g.uid
 
         data = request.get_json(silent=True) or {}
         post_id = data.get("postId")
         if not post_id:
             return jsonify({"ok": False, "error": "missing postId"}), 400
 
-        post_ref = db.collection("posts").document(post_id)
-        post_doc = post_ref.get()
-
-        if not post_doc.exists:
+        post_ref = POSTS.document(post_id)
+        try:
+            action = _toggle_like(post_ref, uid)
+        except LookupError:
             return jsonify({"ok": False, "error": "post not found"}), 404
 
-        post_data = post_doc.to_dict()
-        likes = post_data.get("likes", [])
-
-        if uid in likes:
-            post_ref.update({
-                "likes": firestore.ArrayRemove([uid])
-            })
-            action = "unliked"
-        else:
-            post_ref.update({
-                "likes": firestore.ArrayUnion([uid])
-            })
-            action = "liked"
-
         return jsonify({"ok": True, "postId": post_id, "action": action}), 200
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
@@ -509,8 +853,7 @@ def get_followers():
         return jsonify({"ok": False, "error": str(e)}), 401
 
     try:
-        follower_uids = network._fetch_follower_uids(me_uid)
-        profiles_map = network._load_profiles(follower_uids)
+        follower_uids, profiles_map = network.load_followers(me_uid)
         items = [network._shape_follower_item(profiles_map[u]) for u in follower_uids if u in profiles_map]
         return jsonify({"items": items}), 200
     except Exception as e:
@@ -585,7 +928,7 @@ RECRUITER NOTES:
         result = network._call_gemini_json(full_prompt)
     except Exception as e:
         # SDK missing or API error; fall back locally
-        print(f"[neuro-search] Gemini call failed early: {e}")
+        log.warning("neuro-search: Gemini call failed early: %s", e)
 
     # Validate/clean the model output
     occupation = None
@@ -673,7 +1016,10 @@ def google_meet():
     attendees = body.get("attendees") or []
     tz = str(body.get("timezone") or "America/New_York")
 
-    res = automation._create_google_meet_event(title, start_iso, duration_mins, attendees, tz)
+    try:
+        res = automation._create_google_meet_event(title, start_iso, duration_mins, attendees, tz)
+    except ValueError:
+        return automation._json_error(400, "Invalid 'startAtISO' (expected ISO 8601)")
     if not res.get("ok"):
         # we still return 200 with fallback link so front end can continue
         return jsonify({"ok": True, "meetUrl": res.get("meetUrl"), "warning": res.get("error")})
@@ -705,7 +1051,7 @@ def outreach_send():
     if not to_uid:
         return automation._json_error(400, "Missing 'toUid'")
 
-    conv_id = automation._conv_id_for(me, to_uid)
+    conv_id = conv_id_for(me, to_uid)
 
     # Use precise, timezone-aware UTC
     now = datetime.now(timezone.utc)
@@ -723,18 +1069,22 @@ def outreach_send():
         "automation": True,
     }
 
-    doc_ref = db.collection("conversations").document(conv_id).collection("messages").document()
-    doc_ref.set(data)
+    head_ref = CONVERSATIONS.document(conv_id)
+    doc_ref = head_ref.collection("messages").document()
 
-    # Maintain a conversation head for list views
-    head_ref = db.collection("conversations").document(conv_id)
-    head_ref.set(
+    # Message + conversation head (for list views) in one commit
+    batch = db.batch()
+    batch.set(doc_ref, data)
+    batch.set(
+        head_ref,
         {
             "lastUpdatedAt": now,
             "uids": sorted([me, to_uid]),
+            "messagesVersion": firestore.Increment(1),
         },
         merge=True,
     )
+    batch.commit()
 
     return jsonify({"ok": True, "convId": conv_id, "messageId": doc_ref.id})
 
@@ -837,5 +1187,6 @@ def public_repos():
 
 
 if __name__ == "__main__":
+    # Dev server only; production runs under Gunicorn (see wsgi.py / gunicorn.conf.py)
     port = int(os.getenv("PORT", "5000"))
-    app.run(host="0.0.0.0", port=port, debug=True)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=port, debug=os.getenv("FLASK_DEBUG") == "1")
\ No newline at end of file
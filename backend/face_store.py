@@ -1,33 +1,282 @@
 # face_store.py
-import base64, io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timezone
 from typing import List, Dict, Any
-from PIL import Image
 import numpy as np
 import face_recognition
 from firebase_admin import firestore
 from flask import jsonify
 
-db = firestore.client()
+# FAISS (optional): HNSW approximate search once the gallery is large
+try:
+    import faiss
+    _FAISS_OK = True
+except Exception:
+    _FAISS_OK = False
+
+from common import get_db, logger
+from models.face_encoder import (
+    CUDA_OK, decode_data_url, downscale_for_faces, encode_frame, encode_frames_batched,
+)
+
+db = get_db()
+log = logger.getChild("face_store")
+
+# Frame decode + CNN encoding is CPU-bound; fan it out across processes.
+# "spawn" so workers don't inherit the parent's gRPC/Firebase state.
+# Every gunicorn worker (WEB_CONCURRENCY, same default as gunicorn.conf.py) gets
+# its own pool, so each takes its share of the cores rather than all of them.
+_WEB_WORKERS = int(os.getenv("WEB_CONCURRENCY") or os.cpu_count() or 1)
+FACE_WORKERS = int(os.getenv("FACE_WORKERS") or max(1, (os.cpu_count() or 1) // _WEB_WORKERS))
+_frame_pool = None
+_frame_pool_lock = threading.Lock()
+
+def _get_frame_pool() -> ProcessPoolExecutor:
+    global _frame_pool
+    if _frame_pool is None:
+        with _frame_pool_lock:
+            if _frame_pool is None:
+                _frame_pool = ProcessPoolExecutor(
+                    max_workers=FACE_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _frame_pool
+
+def _reset_frame_pool(broken: ProcessPoolExecutor) -> None:
+    """Drop a pool whose worker died (OOM kill, crash) so the next call builds a fresh one."""
+    global _frame_pool
+    with _frame_pool_lock:
+        if _frame_pool is broken:
+            _frame_pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+def _encode_frames_pooled(images: List[str]) -> List[Any]:
+    """encode_frame over images in the process pool; one retry on a fresh pool if it broke."""
+    for attempt in range(2):
+        pool = _get_frame_pool()
+        try:
+            return list(pool.map(encode_frame, images, chunksize=4))
+        except BrokenProcessPool:
+            log.warning("face frame pool broke; rebuilding (attempt %d)", attempt + 1)
+            _reset_frame_pool(pool)
+    raise RuntimeError("face encoding workers keep crashing")
+
+# Firestore caps a WriteBatch at 500 operations
+FRAME_WRITE_BATCH = 400
+# Parallel single-doc deletes when the SDK has no BulkWriter
+DELETE_WORKERS = 32
+
+# Enrolled embeddings as rows of one float32 matrix (grown by doubling) + row -> uid,
+# kept in sync incrementally: only face docs with updatedAt past the newest one seen
+# are read. A periodic full reload picks up deleted enrollments.
+# Rows are append-only: a replaced or deleted enrollment tombstones its row (uid None,
+# ||row||^2 = inf) so nothing is rebuilt per change; the matrix is compacted once
+# tombstones make up GALLERY_COMPACT_RATIO of it.
+GALLERY_SYNC_SECONDS = 5.0
+GALLERY_FULL_RELOAD_SECONDS = 3600.0
+GALLERY_COMPACT_RATIO = 0.5
+_GALLERY: Dict[str, Any] = {
+    "buf": np.empty((0, 128), np.float32),  # rows [0, n) are in use
+    "sq": np.empty((0,), np.float32),       # ||row||^2 per row of buf, inf for tombstones
+    "n": 0,
+    "uids": [],                             # row -> uid, None for a tombstone
+    "row_of": {},                           # uid -> its live row
+    "dead": 0,
+    "gen": 0,                               # bumped when compaction renumbers rows
+    "last_sync": None,                      # newest updatedAt seen
+    "synced_at": 0.0,
+    "loaded_at": 0.0,
+    "index": None,                          # faiss.IndexHNSWFlat, row ids = matrix rows
+    "index_building": False,
+}
+# Below this many enrollments an exact numpy scan is as fast as HNSW
+FAISS_MIN_GALLERY = 10_000
+FAISS_HNSW_M = 32
+# Neighbours asked of HNSW, so a few tombstoned rows in front still leave a live one
+FAISS_SEARCH_K = 8
+_gallery_lock = threading.Lock()
+
+# The helpers below expect _gallery_lock to be held.
+def _gallery_kill(row: int) -> None:
+    uid = _GALLERY["uids"][row]
+    _GALLERY["uids"][row] = None
+    _GALLERY["sq"][row] = np.inf
+    _GALLERY["row_of"].pop(uid, None)
+    _GALLERY["dead"] += 1
+
+def _gallery_set(uid: str, emb) -> None:
+    """Append uid's embedding as a new row (tombstoning its old one) and add it to the index."""
+    emb = np.ascontiguousarray(emb, dtype=np.float32)
+    row = _GALLERY["row_of"].get(uid)
+    if row is not None:
+        if np.array_equal(_GALLERY["buf"][row], emb):
+            return
+        _gallery_kill(row)
+    n = _GALLERY["n"]
+    if n == len(_GALLERY["buf"]):
+        # New arrays: callers still holding the old views keep a consistent snapshot
+        cap = max(1024, 2 * n)
+        buf = np.empty((cap, 128), np.float32)
+        buf[:n] = _GALLERY["buf"][:n]
+        sq = np.empty((cap,), np.float32)
+        sq[:n] = _GALLERY["sq"][:n]
+        _GALLERY["buf"], _GALLERY["sq"] = buf, sq
+    _GALLERY["buf"][n] = emb
+    _GALLERY["sq"][n] = float(emb @ emb)
+    _GALLERY["uids"].append(uid)
+    _GALLERY["row_of"][uid] = n
+    _GALLERY["n"] = n + 1
+    if _GALLERY["index"] is not None:
+        _GALLERY["index"].add(emb[None, :])
+
+def _gallery_maybe_compact() -> None:
+    n, dead = _GALLERY["n"], _GALLERY["dead"]
+    if not dead or dead < n * GALLERY_COMPACT_RATIO:
+        return
+    live = [r for r in range(n) if _GALLERY["uids"][r] is not None]
+    _GALLERY["buf"] = np.ascontiguousarray(_GALLERY["buf"][live]).reshape(-1, 128)
+    _GALLERY["sq"] = np.ascontiguousarray(_GALLERY["sq"][live])
+    _GALLERY["uids"] = [_GALLERY["uids"][r] for r in live]
+    _GALLERY["row_of"] = {u: i for i, u in enumerate(_GALLERY["uids"])}
+    _GALLERY["n"] = len(live)
+    _GALLERY["dead"] = 0
+    _GALLERY["gen"] += 1
+    # Row ids changed: the index is rebuilt in the background (see _ensure_gallery_index)
+    _GALLERY["index"] = None
+
+def _gallery_snapshot():
+    """(E, row norms^2, uids, live count) for the rows in use right now."""
+    n = _GALLERY["n"]
+    return _GALLERY["buf"][:n], _GALLERY["sq"][:n], list(_GALLERY["uids"][:n]), n - _GALLERY["dead"]
+
+def _build_gallery_index(gen: int, E) -> None:
+    """Build HNSW over a snapshot without the lock, then catch up on rows added meanwhile and swap it in."""
+    try:
+        index = faiss.IndexHNSWFlat(E.shape[1], FAISS_HNSW_M)
+        index.add(E)
+        with _gallery_lock:
+            if _GALLERY["gen"] == gen:
+                n = _GALLERY["n"]
+                if n > len(E):
+                    index.add(np.ascontiguousarray(_GALLERY["buf"][len(E):n]))
+                _GALLERY["index"] = index
+    except Exception as e:
+        log.warning("face index build failed: %s: %s", type(e).__name__, e)
+    finally:
+        with _gallery_lock:
+            _GALLERY["index_building"] = False
+
+def _ensure_gallery_index() -> None:
+    """Start a background HNSW build once the gallery is large enough; exact scans serve until then."""
+    if not _FAISS_OK:
+        return
+    with _gallery_lock:
+        if _GALLERY["index"] is not None or _GALLERY["index_building"]:
+            return
+        if _GALLERY["n"] - _GALLERY["dead"] < FAISS_MIN_GALLERY:
+            return
+        _GALLERY["index_building"] = True
+        gen, E = _GALLERY["gen"], _GALLERY["buf"][:_GALLERY["n"]]
+    threading.Thread(target=_build_gallery_index, args=(gen, E), name="face-index", daemon=True).start()
+
+def _index_nearest(q):
+    """(uid, distance) of the nearest live row via HNSW, or None to fall back to the exact scan."""
+    with _gallery_lock:
+        # faiss indexes are not safe to search while another thread adds to them
+        index = _GALLERY["index"]
+        if index is None or index.ntotal == 0:
+            return None
+        D, I = index.search(q, min(FAISS_SEARCH_K, index.ntotal))  # squared L2
+        uids = _GALLERY["uids"]
+        for d2, row in zip(D[0], I[0]):
+            if 0 <= row < len(uids) and uids[row] is not None:
+                return uids[row], float(np.sqrt(max(float(d2), 0.0)))
+    return None
+
+def _refresh_gallery(db):
+    """Returns (E, row norms^2, uids, live count), reading only face docs changed since the last sync."""
+    now = time.time()
+    with _gallery_lock:
+        if now - _GALLERY["synced_at"] <= GALLERY_SYNC_SECONDS:
+            return _gallery_snapshot()
+        full = now - _GALLERY["loaded_at"] > GALLERY_FULL_RELOAD_SECONDS
+        last_sync = None if full else _GALLERY["last_sync"]
+
+    q = db.collection("face").select(["embeddingsF16", "embeddings", "updatedAt"])
+    if last_sync is not None:
+        q = q.where("updatedAt", ">", last_sync)
+    changed = []
+    newest = last_sync
+    for doc in q.stream():
+        data = doc.to_dict() or {}
+        changed.append((doc.id, _decode_embedding(data)))
+        updated = data.get("updatedAt")
+        if updated is not None and (newest is None or updated > newest):
+            newest = updated
+
+    with _gallery_lock:
+        row_of = _GALLERY["row_of"]
+        if full:
+            # A full read lists every enrollment: anything missing was deleted
+            seen = {uid for uid, _ in changed}
+            for uid in [u for u in row_of if u not in seen]:
+                _gallery_kill(row_of[uid])
+            _GALLERY["loaded_at"] = now
+        for uid, emb in changed:
+            if emb is not None:
+                _gallery_set(uid, emb)
+            elif uid in row_of:
+                _gallery_kill(row_of[uid])
+        _gallery_maybe_compact()
+        _GALLERY["last_sync"] = newest
+        _GALLERY["synced_at"] = now
+        return _gallery_snapshot()
+
+def _encode_embedding(emb: np.ndarray) -> bytes:
+    """float16 little-endian bytes: 256 B on the wire instead of 128 boxed doubles."""
+    return np.asarray(emb, dtype="<f2").tobytes()
+
+def _decode_embedding(data: Dict[str, Any]):
+    """face/{uid} -> float32 vector; reads legacy list-of-floats docs too."""
+    raw = data.get("embeddingsF16")
+    if raw:
+        return np.frombuffer(raw, dtype="<f2").astype(np.float32)
+    emb = data.get("embeddings")
+    return np.asarray(emb, dtype=np.float32) if emb else None
+
+def _gallery_put(uid: str, emb) -> None:
+    """Apply a local enrollment to the in-memory gallery (and index) without a reload."""
+    with _gallery_lock:
+        _gallery_set(uid, emb)
+        _gallery_maybe_compact()
 
 def _utc_now():
     return datetime.now(timezone.utc)
 
 def _clear_frames_subcollection(face_doc_ref) -> int:
     """Delete all docs under face/{uid}/frames. Returns number deleted."""
-    frames_ref = face_doc_ref.collection("frames")
-    deleted = 0
-    # Delete in small batches to avoid timeouts/limits
-    while True:
-        batch = db.batch()
-        docs = list(frames_ref.limit(300).stream())
-        if not docs:
-            break
-        for d in docs:
-            batch.delete(d.reference)
-            deleted += 1
-        batch.commit()
-    return deleted
+    # Empty projection: we only need the references
+    refs = [d.reference for d in face_doc_ref.collection("frames").select([]).stream()]
+    if not refs:
+        return 0
+
+    # BulkWriter keeps many deletes in flight (with retries) instead of one batch at a time
+    bulk_writer = getattr(db, "bulk_writer", None)
+    if bulk_writer is not None:
+        bw = bulk_writer()
+        for ref in refs:
+            bw.delete(ref)
+        bw.close()  # flushes and waits for every queued write
+        return len(refs)
+
+    with ThreadPoolExecutor(max_workers=min(DELETE_WORKERS, len(refs))) as ex:
+        list(ex.map(lambda ref: ref.delete(), refs))
+    return len(refs)
 
 def save_face_enrollment(uid: str, frames: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
@@ -42,14 +291,15 @@ def save_face_enrollment(uid: str, frames: List[Dict[str, Any]]) -> Dict[str, An
         return {"ok": False, "error": "No frames provided"}
 
     face_doc = db.collection("face").document(uid)
+    now = _utc_now()
 
     # Preserve existing createdAt if present, otherwise set it
     snap = face_doc.get()
     created_at = snap.to_dict().get("createdAt") if snap.exists else None
     face_doc.set(
         {
-            "createdAt": created_at or _utc_now(),
-            "updatedAt": _utc_now(),
+            "createdAt": created_at or now,
+            "updatedAt": now,
         },
         merge=True,
     )
@@ -60,48 +310,62 @@ def save_face_enrollment(uid: str, frames: List[Dict[str, Any]]) -> Dict[str, An
     enc_list = []
     saved_frames = 0
 
-    for f in frames:
-        pose = f.get("pose")
-        image_data = f.get("image")
-        if not isinstance(image_data, str) or "," not in image_data:
-            continue
+    valid = [
+        (f.get("pose"), f.get("image"))
+        for f in frames
+        if isinstance(f.get("image"), str) and "," in f.get("image")
+    ]
+    images = [img for _, img in valid]
+    if CUDA_OK:
+        # One batched GPU detection pass beats fanning single frames out to CPUs
+        vectors = encode_frames_batched(images)
+    else:
+        vectors = _encode_frames_pooled(images)
+
+    # Only accept frames with exactly one face (encode_frame returns None otherwise)
+    encoded = [(pose, vec) for (pose, _), vec in zip(valid, vectors) if vec is not None]
 
+    # Persist all frame docs in batched commits instead of one add() per frame
+    frames_ref = face_doc.collection("frames")
+    for start in range(0, len(encoded), FRAME_WRITE_BATCH):
+        chunk = encoded[start:start + FRAME_WRITE_BATCH]
+        batch = db.batch()
+        for pose, vec in chunk:
+            batch.set(
+                frames_ref.document(),
+                {
+                    "pose": pose,
+                    "vector": vec.tolist(),
+                    "createdAt": now,
+                },
+            )
         try:
-            img_b64 = image_data.split(",", 1)[1]
-            img = Image.open(io.BytesIO(base64.b64decode(img_b64))).convert("RGB")
-            img_np = np.array(img)
-            encs = face_recognition.face_encodings(img_np)
-
-            # Only accept frames with exactly one face
-            if len(encs) == 1:
-                vec = encs[0]
-                enc_list.append(vec)
-                face_doc.collection("frames").add(
-                    {
-                        "pose": pose,
-                        "vector": vec.tolist(),
-                        "createdAt": _utc_now(),
-                    }
-                )
-                saved_frames += 1
+            batch.commit()
         except Exception as e:
-            print(f"[save_face_enrollment] Frame error: {e}")
+            log.warning("save_face_enrollment: frame batch error: %s", e)
+            continue
+        enc_list.extend(vec for _, vec in chunk)
+        saved_frames += len(chunk)
 
     if not enc_list:
         # If nothing valid, ensure frames stay empty and updatedAt moves forward
         return {"ok": False, "error": "No valid faces detected", "frames_deleted": old_count}
 
     # 3) Average & store the master embedding
-    final_emb = np.mean(np.vstack(enc_list), axis=0).tolist()
+    final_emb = np.mean(np.vstack(enc_list), axis=0)
     face_doc.set(
         {
-            "embeddings": final_emb,
+            "embeddingsF16": _encode_embedding(final_emb),
+            "embeddings": firestore.DELETE_FIELD,
             "vectorDims": len(final_emb),
             "frameCount": saved_frames,
+            # Fresh on purpose: the gallery sync reads updatedAt > newest seen, and
+            # the first write above may already have been seen with `now`
             "updatedAt": _utc_now(),
         },
         merge=True,
     )
+    _gallery_put(uid, np.frombuffer(_encode_embedding(final_emb), dtype="<f2"))
 
     return {
         "ok": True,
@@ -113,9 +377,7 @@ def save_face_enrollment(uid: str, frames: List[Dict[str, Any]]) -> Dict[str, An
     }
 
 def detect_face(image_data, db):
-    img_b64 = image_data.split(",", 1)[1]
-    img = Image.open(io.BytesIO(base64.b64decode(img_b64))).convert("RGB")
-    img_np = np.array(img)
+    img_np = downscale_for_faces(decode_data_url(image_data))
 
     # Get embedding
     encs = face_recognition.face_encodings(img_np)
@@ -124,34 +386,31 @@ def detect_face(image_data, db):
 
     query_vec = encs[0]
 
-    # Fetch enrolled faces
-    # db = firestore.client()
-    docs = list(db.collection("face").stream())
-
-    if not docs:
-        return jsonify({"ok": False, "error": "No enrolled users found"}), 404
-
-    best_uid = None
-    best_dist = float("inf")
-
-    for doc in docs:
-        emb = doc.to_dict().get('embeddings')
-        if not emb:
-            continue
-        stored_vec = np.array(emb)
-        dist = np.linalg.norm(query_vec - stored_vec)
-        if dist < best_dist:
-            best_dist = dist
-            best_uid = doc.id
-
-    if not best_uid:
+    E, sq, uids, live = _refresh_gallery(db)
+    if not live:
         return jsonify({"ok": False, "error": "No embeddings available"}), 404
 
+    q = query_vec.astype(np.float32)[None, :]
+    _ensure_gallery_index()
+    hit = _index_nearest(q)
+    if hit is not None:
+        best_uid, best_dist = hit
+    else:
+        # ||e - q||^2 = ||e||^2 - 2 e.q + ||q||^2: one BLAS GEMV (E @ q) over the gallery,
+        # same distances and threshold as before (dlib vectors are not unit-norm).
+        # Tombstoned rows carry ||e||^2 = inf and never win.
+        d2 = sq - 2.0 * (E @ q[0]) + float(q[0] @ q[0])
+        i = int(d2.argmin())
+        best_dist = float(np.sqrt(max(float(d2[i]), 0.0)))
+        best_uid = uids[i]
+        if best_uid is None:
+            return jsonify({"ok": False, "error": "No embeddings available"}), 404
+
     # Final threshold check
     MATCH_THRESHOLD = 0.6
     if best_dist < MATCH_THRESHOLD:
         # fetch user profile
-        user_doc = db.collection("users").document(best_uid).get()
+        user_doc = db.collection("users").document(best_uid).get(field_paths=["fullName", "occupation"])
         user_data = user_doc.to_dict() if user_doc.exists else {}
 
         return jsonify({
@@ -2,12 +2,42 @@
 from __future__ import annotations
 
 import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timezone
 from flask import Blueprint, request, jsonify
-from firebase_admin import firestore
 
-db = firestore.client()
+from common import get_db
+from profiles_api import get_user_by_slug
+
+db = get_db()
+
+# One pooled keep-alive session for all GitHub calls (skips a TLS handshake per request)
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+    ),
+)
+_SESSION.headers.update({"Accept": "application/vnd.github+json", "User-Agent": "NeuroApp/1.0"})
+
+# (username, limit) -> (etag, items, stored_at). Revalidated with If-None-Match;
+# a 304 costs no rate limit and no body.
+GH_CACHE_MAX = 1024
+GH_CACHE_TTL_SECONDS = 600.0
+_GH_CACHE: "OrderedDict[Tuple[str, int], Tuple[str, List[Dict[str, Any]], float]]" = OrderedDict()
+_gh_cache_lock = threading.Lock()
+
+_GH_URL_RE = re.compile(r"github\.com/([^/?#]+)")
 
 # ---------- helpers ----------
 
@@ -21,12 +51,8 @@ def _profile_by_slug(slug: str):
     slug = (slug or "").strip().lower()
     if not slug:
         return None
-    q = _users_col().where("slug", "==", slug).limit(1).stream()
-    for d in q:
-        doc = d.to_dict() or {}
-        doc["id"] = d.id
-        return doc
-    return None
+    # Cached slug -> user resolution shared with the profile routes
+    return get_user_by_slug(slug)
 
 def _extract_github_username_from_profile(doc: dict) -> str | None:
     """
@@ -54,7 +80,7 @@ def _extract_github_username_from_profile(doc: dict) -> str | None:
         gh_url = links.get("github")
         if isinstance(gh_url, str) and gh_url.strip():
             # Extract last path segment as username
-            m = re.search(r"github\.com/([^/?#]+)", gh_url)
+            m = _GH_URL_RE.search(gh_url)
             if m:
                 return m.group(1)
 
@@ -73,16 +99,29 @@ def _gh_get_user_repos(username: str, limit: int):
     Sorted by update (desc) via query params.
     """
     url = f"https://api.github.com/users/{username}/repos"
+    key = (username.lower(), limit)
+    with _gh_cache_lock:
+        cached = _GH_CACHE.get(key)
+        if cached and time.time() - cached[2] > GH_CACHE_TTL_SECONDS:
+            del _GH_CACHE[key]
+            cached = None
+
     try:
-        res = requests.get(
+        res = _SESSION.get(
             url,
             params={"sort": "updated", "per_page": str(limit)},
-            headers={"Accept": "application/vnd.github+json", "User-Agent": "NeuroApp/1.0"},
+            headers={"If-None-Match": cached[0]} if cached else None,
             timeout=15,
         )
     except requests.RequestException as e:
         return None, f"Network error contacting GitHub: {e}"
 
+    if res.status_code == 304 and cached:
+        with _gh_cache_lock:
+            _GH_CACHE[key] = (cached[0], cached[1], time.time())
+            _GH_CACHE.move_to_end(key)
+        return cached[1], None
+
     if res.status_code == 404:
         return [], None  # user not found -> just show none
     if res.status_code != 200:
@@ -107,6 +146,15 @@ def _gh_get_user_repos(username: str, limit: int):
         })
     # API already sorts by updated desc, but ensure:
     items.sort(key=lambda x: x.get("updated_at") or "", reverse=True)
-    return items[:limit], None
+    items = items[:limit]
+
+    etag = res.headers.get("ETag")
+    if etag:
+        with _gh_cache_lock:
+            _GH_CACHE[key] = (etag, items, time.time())
+            _GH_CACHE.move_to_end(key)
+            while len(_GH_CACHE) > GH_CACHE_MAX:
+                _GH_CACHE.popitem(last=False)
+    return items, None
 
 # ---------- routes ----------
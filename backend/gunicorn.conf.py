@@ -0,0 +1,18 @@
+# gunicorn.conf.py
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+
+# Threads cover Firestore / Gemini I/O inside each worker
+workers = int(os.getenv("WEB_CONCURRENCY") or multiprocessing.cpu_count())
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS") or 8)
+
+# Import the app (Firebase init, service-account parsing) once in the master and
+# fork workers from it. Safe because no Firestore RPC runs at import time, so no
+# gRPC channel exists before the fork.
+preload_app = True
+
+timeout = 60
+keepalive = 5
@@ -7,21 +7,17 @@ from datetime import datetime
 
 from firebase_admin import firestore
 
-# Use a fresh client each call (safe under firebase_admin)
-def _db():
-    return firestore.client()
+from common import conv_id_for, get_db
+
+# The process-wide client (built once in common.get_db)
+_db = get_db
 
 # ----------------------------
 # Helpers
 # ----------------------------
 
-def _conv_id_for(a: str, b: str) -> str:
-    """Deterministic 2-user conversation id."""
-    x, y = sorted([a.strip(), b.strip()])
-    return f"{x}__{y}"
-
 def _conv_ref(uid_a: str, uid_b: str):
-    return _db().collection("conversations").document(_conv_id_for(uid_a, uid_b))
+    return _db().collection("conversations").document(conv_id_for(uid_a.strip(), uid_b.strip()))
 
 def _clean_text(s: str, max_len: int = 5000) -> str:
     s = (s or "").strip()
@@ -29,8 +25,14 @@ def _clean_text(s: str, max_len: int = 5000) -> str:
         s = s[:max_len]
     return s
 
-def _ensure_participants(conv_ref, a: str, b: str) -> None:
-    conv_ref.set({"participants": [a, b]}, merge=True)
+def _ensure_participants(conv_ref, a: str, b: str, batch=None) -> None:
+    """Upsert the conversation head. Commit it with (or after) the message writes:
+    the version bump is what invalidates cached message tails (see ai._fetch_last_messages)."""
+    data = {"participants": [a, b], "messagesVersion": firestore.Increment(1)}
+    if batch is not None:
+        batch.set(conv_ref, data, merge=True)
+    else:
+        conv_ref.set(data, merge=True)
 
 def _serialize_ts(ts: Optional[datetime]) -> Dict[str, Any]:
     """Return dict with both ISO string and ms since epoch (if ts exists)."""
@@ -64,15 +66,19 @@ def send_message(uid: str, to_uid: str, text: str) -> Dict[str, Any]:
         return {"ok": False, "error": "empty message"}
 
     conv = _conv_ref(uid, to_uid)
-    _ensure_participants(conv, uid, to_uid)
 
     msg_ref = conv.collection("messages").document()  # auto id
-    msg_ref.set({
+
+    # Message + conversation head in one atomic commit (one round-trip)
+    batch = _db().batch()
+    batch.set(msg_ref, {
         "from": uid,
         "to": to_uid,
         "text": text,
         "createdAt": firestore.SERVER_TIMESTAMP,  # ✅ server-side time
     })
+    _ensure_participants(conv, uid, to_uid, batch)
+    batch.commit()
 
     return {"ok": True, "conversationId": conv.id, "messageId": msg_ref.id}
 
@@ -143,12 +149,13 @@ def list_partners(uid: str, max_conversations: int = 50) -> Dict[str, Any]:
     q = db.collection("conversations").where("participants", "array_contains", uid).limit(max_conversations)
     convs = q.get()
 
-    partners: List[str] = []
+    # dict keys: O(1) dedup that keeps first-seen order
+    seen: Dict[str, None] = {}
     for c in convs:
-        parts = (c.to_dict() or {}).get("participants", [])
-        for p in parts:
-            if p != uid and p not in partners:
-                partners.append(p)
+        for p in (c.to_dict() or {}).get("participants", ()):
+            if p != uid:
+                seen[p] = None
+    partners: List[str] = list(seen)
 
     return {"ok": True, "partners": partners}
 
@@ -170,7 +177,6 @@ def seed_demo(requester_uid: str, a: str, b: str) -> Dict[str, Any]:
         return {"ok": False, "error": "need two different uids 'a' and 'b'"}
 
     conv = _conv_ref(a, b)
-    _ensure_participants(conv, a, b)
 
     msgs = [
         {"from": a, "to": b, "text": "Hey there!", "createdAt": firestore.SERVER_TIMESTAMP},
@@ -181,6 +187,7 @@ def seed_demo(requester_uid: str, a: str, b: str) -> Dict[str, Any]:
     batch = _db().batch()
     for m in msgs:
         batch.set(conv.collection("messages").document(), m)
+    _ensure_participants(conv, a, b, batch)
     batch.commit()
 
     return {"ok": True, "conversationId": conv.id, "seeded": len(msgs)}
@@ -0,0 +1,128 @@
+# models/face_encoder.py
+# Pure image -> embedding helpers. Kept free of Flask/Firebase imports so the
+# face enrollment process pool can import it cheaply in worker processes.
+from __future__ import annotations
+
+import io
+import logging
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import face_recognition
+from PIL import Image
+
+# pybase64 (SIMD) when installed; stdlib otherwise. Pillow-SIMD is a drop-in
+# replacement for Pillow and needs no code changes here.
+try:
+    from pybase64 import b64decode as _b64decode
+except Exception:
+    from base64 import b64decode as _b64decode
+
+# OpenCV decodes JPEG/PNG several times faster than Pillow when installed
+try:
+    import cv2
+    _CV2_OK = True
+except Exception:
+    _CV2_OK = False
+
+# dlib built with CUDA: the CNN detector can take a whole burst of frames at once
+try:
+    import dlib
+    CUDA_OK = bool(getattr(dlib, "DLIB_USE_CUDA", False))
+except Exception:
+    CUDA_OK = False
+
+# Plain stdlib logger: pool workers don't import common (no Firebase); under the
+# API process it is a child of common.logger and goes through its queue handler
+log = logging.getLogger("neuro.face_encoder")
+
+# Largest side we ask libjpeg to keep while decoding (it downsamples by 1/2..1/8)
+MAX_DECODE_DIM = 1024
+# Largest side handed to face detection/encoding. HOG detection is O(W*H) and the
+# 128D encoding is computed on a fixed 150x150 aligned chip, so webcam frames lose
+# nothing useful at this size.
+FACE_MAX_DIM = int(os.getenv("FACE_MAX_DIM") or 320)
+
+
+def decode_data_url(image_data: str) -> np.ndarray:
+    """'data:image/...;base64,<payload>' -> HxWx3 uint8 RGB array."""
+    raw = _b64decode(image_data.split(",", 1)[1])
+
+    if _CV2_OK:
+        # Native libjpeg-turbo/libpng decode straight from the bytes, no PIL objects
+        arr = cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
+        if arr is not None:
+            h, w = arr.shape[:2]
+            if max(h, w) > MAX_DECODE_DIM:
+                scale = MAX_DECODE_DIM / max(h, w)
+                arr = cv2.resize(arr, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+            return cv2.cvtColor(arr, cv2.COLOR_BGR2RGB)
+        # Formats OpenCV can't read fall through to Pillow
+
+    img = Image.open(io.BytesIO(raw))
+    # JPEG only: let the decoder scale oversized frames down instead of resizing after
+    img.draft("RGB", (MAX_DECODE_DIM, MAX_DECODE_DIM))
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return np.asarray(img, dtype=np.uint8)
+
+
+def downscale_for_faces(arr: np.ndarray) -> np.ndarray:
+    """Shrink so the longest side is at most FACE_MAX_DIM (never upscales)."""
+    h, w = arr.shape[:2]
+    scale = FACE_MAX_DIM / max(h, w)
+    if scale >= 1:
+        return arr
+    size = (max(1, int(w * scale)), max(1, int(h * scale)))
+    if _CV2_OK:
+        return cv2.resize(arr, size, interpolation=cv2.INTER_AREA)
+    return np.asarray(Image.fromarray(arr).resize(size, Image.BILINEAR), dtype=np.uint8)
+
+
+def encode_frame(image_data: str) -> Optional[np.ndarray]:
+    """
+    Decode one enrollment frame and return its 128D face encoding.
+    Returns None unless exactly one face is found (or the frame is unreadable).
+    """
+    try:
+        encs = face_recognition.face_encodings(downscale_for_faces(decode_data_url(image_data)))
+    except Exception as e:
+        log.warning("Frame error: %s", e)
+        return None
+    return encs[0] if len(encs) == 1 else None
+
+
+def encode_frames_batched(images: List[str], batch_size: int = 32) -> List[Optional[np.ndarray]]:
+    """
+    encode_frame() for a whole enrollment burst, using one batched CNN face
+    detection pass per frame size (GPU path; only worth it when CUDA_OK).
+    Returns one entry per input, in order.
+    """
+    out: List[Optional[np.ndarray]] = [None] * len(images)
+
+    # batch_face_locations needs equally-sized frames; group instead of resizing
+    groups: Dict[tuple, List[tuple]] = {}
+    for i, image_data in enumerate(images):
+        try:
+            arr = downscale_for_faces(decode_data_url(image_data))
+        except Exception as e:
+            log.warning("Frame error: %s", e)
+            continue
+        groups.setdefault(arr.shape, []).append((i, arr))
+
+    for members in groups.values():
+        arrays = [arr for _, arr in members]
+        try:
+            locs = face_recognition.batch_face_locations(
+                arrays, number_of_times_to_upsample=0, batch_size=batch_size
+            )
+        except Exception as e:
+            log.warning("Batch detect error: %s", e)
+            continue
+        for (i, arr), frame_locs in zip(members, locs):
+            if len(frame_locs) != 1:
+                continue
+            encs = face_recognition.face_encodings(arr, known_face_locations=frame_locs)
+            out[i] = encs[0] if encs else None
+    return out
@@ -1,41 +1,41 @@
 # backend/network.py
 from __future__ import annotations
 
+import copy
+import hashlib
 import json
 import math
 import os
 import re
+import threading
 import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Set, Tuple
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
-import firebase_admin
-from firebase_admin import auth as fb_auth, credentials, firestore
+import numpy as np
 from flask import Blueprint, jsonify, request
 
+from common import ensure_firebase, get_db, logger, verify_id_token
+
 # ------------------------------------------------------------------------------
-# Firebase init (lazy)
+# Firebase (shared process-wide client, see common.get_db)
 # ------------------------------------------------------------------------------
-SERVICE_ACCOUNT_PATH = os.getenv(
-    "GOOGLE_APPLICATION_CREDENTIALS",
-    "neru-b3128-firebase-adminsdk-fbsvc-11110f3ad3.json",
-)
-
-def _ensure_firebase() -> None:
-    if not firebase_admin._apps:
-        cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
-        firebase_admin.initialize_app(cred)
-
-def _db() -> firestore.Client:
-    _ensure_firebase()
-    return firestore.client()
+_ensure_firebase = ensure_firebase
+_db = get_db
+log = logger.getChild("network")
 
 # ------------------------------------------------------------------------------
 # Auth helpers
 # ------------------------------------------------------------------------------
+_BEARER_RE = re.compile(r"^Bearer\s+(.+)$", re.I)
+
 def _extract_bearer_token(req) -> Optional[str]:
     h = req.headers.get("Authorization") or ""
-    m = re.match(r"^Bearer\s+(.+)$", h.strip(), flags=re.I)
+    m = _BEARER_RE.match(h.strip())
     return m.group(1) if m else None
 
 def verify_token(req) -> Tuple[str, dict]:
@@ -43,7 +43,7 @@ def verify_token(req) -> Tuple[str, dict]:
     token = _extract_bearer_token(req)
     if not token:
         raise ValueError("Missing Authorization Bearer token")
-    decoded = fb_auth.verify_id_token(token)
+    decoded = verify_id_token(token)
     uid = decoded.get("uid")
     if not uid:
         raise ValueError("Token missing uid")
@@ -52,12 +52,26 @@ def verify_token(req) -> Tuple[str, dict]:
 # ------------------------------------------------------------------------------
 # Slug / display helpers
 # ------------------------------------------------------------------------------
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9\s-]")
+_WS_RE = re.compile(r"\s+")
+_DASHES_RE = re.compile(r"-+")
+
+# ASCII fast path for kebab_name: delete everything but [a-z0-9], whitespace and '-'
+_KEBAB_KEEP = frozenset("abcdefghijklmnopqrstuvwxyz0123456789-") | {
+    chr(c) for c in range(128) if chr(c).isspace()
+}
+_KEBAB_TRANS = str.maketrans("", "", "".join(chr(c) for c in range(128) if chr(c) not in _KEBAB_KEEP))
+
+@lru_cache(maxsize=8192)
 def kebab_name(first: Optional[str], last: Optional[str], full: Optional[str]) -> str:
     base = full.strip() if full and full.strip() else " ".join([first or "", last or ""]).strip() or "user"
     s = base.lower()
-    s = re.sub(r"[^a-z0-9\s-]", "", s)
-    s = re.sub(r"\s+", "-", s)
-    s = re.sub(r"-+", "-", s).strip("-")
+    if s.isascii():
+        # Whitespace and dash runs both collapse to a single '-'
+        return "-".join(s.translate(_KEBAB_TRANS).replace("-", " ").split()) or "user"
+    s = _NON_ALNUM_RE.sub("", s)
+    s = _WS_RE.sub("-", s)
+    s = _DASHES_RE.sub("-", s).strip("-")
     return s or "user"
 
 # ------------------------------------------------------------------------------
@@ -66,7 +80,7 @@ def kebab_name(first: Optional[str], last: Optional[str], full: Optional[str]) -
 def _fetch_followers_array_field(uid: str) -> List[str]:
     try:
         db = _db()
-        snap = db.collection("users").document(uid).get()
+        snap = db.collection("users").document(uid).get(field_paths=["followers"])
         if not snap.exists:
             return []
         data = snap.to_dict() or {}
@@ -94,7 +108,7 @@ def _fetch_followers_subcollection(uid: str) -> List[str]:
         pass
     return list(out)
 
-def _fetch_followers_relations(uid: str) -> List[str]:
+def _fetch_rel_followee(uid: str) -> List[str]:
     out: Set[str] = set()
     try:
         db = _db()
@@ -106,6 +120,10 @@ def _fetch_followers_relations(uid: str) -> List[str]:
                 out.add(follower_uid)
     except Exception:
         pass
+    return list(out)
+
+def _fetch_rel_to(uid: str) -> List[str]:
+    out: Set[str] = set()
     try:
         db = _db()
         q2 = db.collection("relations").where("to", "==", uid)
@@ -118,40 +136,159 @@ def _fetch_followers_relations(uid: str) -> List[str]:
         pass
     return list(out)
 
-def _fetch_follower_uids(uid: str) -> List[str]:
-    prim = _fetch_followers_array_field(uid)
-    subc = _fetch_followers_subcollection(uid)
-    rels = _fetch_followers_relations(uid)
-    dedup: Set[str] = set(prim) | set(subc) | set(rels)
-    return sorted(dedup)
+# The schema lookups are independent network-bound reads: run them concurrently
+_FOLLOWER_SOURCES = (
+    _fetch_followers_array_field,
+    _fetch_followers_subcollection,
+    _fetch_rel_followee,
+    _fetch_rel_to,
+)
+# Shared by every request thread in the worker (gunicorn threads, see
+# gunicorn.conf.py): room for each of them to have all its sources in flight
+_REQUEST_THREADS = int(os.getenv("GUNICORN_THREADS") or 8)
+_NETWORK_POOL_WORKERS = _REQUEST_THREADS * len(_FOLLOWER_SOURCES)
+_follower_pool = ThreadPoolExecutor(max_workers=_NETWORK_POOL_WORKERS, thread_name_prefix="followers")
+
+# uid -> (stored_at, follower uids)
+FOLLOWERS_CACHE_TTL_SECONDS = 60.0
+FOLLOWERS_CACHE_MAX = 10_000
+_followers_cache: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+_followers_cache_lock = threading.Lock()
+
+def _fetch_follower_uids(uid: str, on_batch: Optional[Callable[[List[str]], None]] = None) -> List[str]:
+    """
+    Union of every follower source. on_batch, if given, is called with each group of
+    not-yet-seen uids as soon as its source finishes, so callers can start work early.
+    """
+    now = time.time()
+    with _followers_cache_lock:
+        hit = _followers_cache.get(uid)
+        if hit and now - hit[0] <= FOLLOWERS_CACHE_TTL_SECONDS:
+            _followers_cache.move_to_end(uid)
+            out = list(hit[1])
+            if on_batch and out:
+                on_batch(list(out))
+            return out
+
+    futures = [_follower_pool.submit(fn, uid) for fn in _FOLLOWER_SOURCES]
+    dedup: Set[str] = set()
+    for f in as_completed(futures):
+        new = [u for u in dict.fromkeys(f.result()) if u not in dedup]
+        dedup.update(new)
+        if on_batch and new:
+            on_batch(new)
+    # Source order, first occurrence wins: deterministic without an O(n log n) sort
+    out = list(dict.fromkeys(u for f in futures for u in f.result()))
+
+    with _followers_cache_lock:
+        _followers_cache[uid] = (now, out)
+        _followers_cache.move_to_end(uid)
+        while len(_followers_cache) > FOLLOWERS_CACHE_MAX:
+            _followers_cache.popitem(last=False)
+    return list(out)
 
-def _chunk(lst: List[str], n: int) -> List[List[str]]:
-    return [lst[i:i+n] for i in range(0, len(lst), n)]
+# users/{uid} snapshots for follower cards; None records a missing profile
+PROFILE_CACHE_TTL_SECONDS = 300.0
+PROFILE_CACHE_MAX = 10_000
+# Only what _shape_follower_item reads
+FOLLOWER_PROFILE_FIELDS = [
+    "firstName", "lastName", "fullName", "slug", "avatarUrl", "occupation",
+    "headline", "interests", "skills", "tags", "topics", "bio",
+]
+_profile_cache: "OrderedDict[str, Tuple[float, Optional[dict]]]" = OrderedDict()
+_profile_cache_lock = threading.Lock()
 
 def _load_profiles(uids: List[str]) -> Dict[str, dict]:
     profiles: Dict[str, dict] = {}
     if not uids:
         return profiles
+
+    now = time.time()
+    missing: List[str] = []
+    with _profile_cache_lock:
+        for u in uids:
+            hit = _profile_cache.get(u)
+            if hit and now - hit[0] <= PROFILE_CACHE_TTL_SECONDS:
+                if hit[1] is not None:
+                    profiles[u] = hit[1]
+            else:
+                missing.append(u)
+    if not missing:
+        return profiles
+
     db = _db()
-    for batch in _chunk(uids, 10):
-        try:
-            q = db.collection("users").where(firestore.FieldPath.document_id(), "in", batch)
-            for doc in q.stream():
-                data = doc.to_dict() or {}
-                data["uid"] = doc.id
-                profiles[doc.id] = data
-        except Exception:
-            for u in batch:
-                try:
-                    d = db.collection("users").document(u).get()
-                    if d.exists:
-                        data = d.to_dict() or {}
-                        data["uid"] = d.id
-                        profiles[u] = data
-                except Exception:
-                    pass
+    users = db.collection("users")
+    fetched: Dict[str, Optional[dict]] = {}
+
+    def _keep(snap) -> None:
+        if snap.exists:
+            data = snap.to_dict() or {}
+            data["uid"] = snap.id
+            fetched[snap.id] = data
+        else:
+            fetched[snap.id] = None
+
+    try:
+        # One streamed multi-doc RPC for every miss (no 10-id IN / per-batch limits)
+        for snap in db.get_all([users.document(u) for u in missing], field_paths=FOLLOWER_PROFILE_FIELDS):
+            _keep(snap)
+    except Exception:
+        # Stream broke part-way: fetch whatever is left one doc at a time
+        for u in missing:
+            if u in fetched:
+                continue
+            try:
+                _keep(users.document(u).get(field_paths=FOLLOWER_PROFILE_FIELDS))
+            except Exception:
+                pass
+
+    with _profile_cache_lock:
+        for u, data in fetched.items():
+            _profile_cache[u] = (now, data)
+            _profile_cache.move_to_end(u)
+        while len(_profile_cache) > PROFILE_CACHE_MAX:
+            _profile_cache.popitem(last=False)
+
+    profiles.update({u: d for u, d in fetched.items() if d is not None})
     return profiles
 
+_profile_pool = ThreadPoolExecutor(max_workers=_NETWORK_POOL_WORKERS, thread_name_prefix="profiles")
+
+def load_followers(uid: str) -> Tuple[List[str], Dict[str, dict]]:
+    """
+    Follower uids plus their profiles. Profile reads for each follower source start
+    as soon as that source returns, overlapping the slower source lookups.
+    """
+    pending = []
+    follower_uids = _fetch_follower_uids(
+        uid, on_batch=lambda new: pending.append(_profile_pool.submit(_load_profiles, new))
+    )
+    profiles: Dict[str, dict] = {}
+    for f in pending:
+        profiles.update(f.result())
+    return follower_uids, profiles
+
+def clear_network_cache(*uids: str) -> None:
+    """
+    Drop these users' cached follower lists and profile cards (after a follow or
+    profile write), or every cached list, profile and Gemini answer when called
+    with none (tests / admin backfills).
+    """
+    if uids:
+        with _followers_cache_lock:
+            for u in uids:
+                _followers_cache.pop(u, None)
+        with _profile_cache_lock:
+            for u in uids:
+                _profile_cache.pop(u, None)
+        return
+    with _followers_cache_lock:
+        _followers_cache.clear()
+    with _profile_cache_lock:
+        _profile_cache.clear()
+    with _gemini_cache_lock:
+        _gemini_cache.clear()
+
 def _shape_follower_item(p: dict) -> dict:
     first = p.get("firstName")
     last = p.get("lastName")
@@ -176,6 +313,23 @@ def _shape_follower_item(p: dict) -> dict:
 # ------------------------------------------------------------------------------
 OCC_DEFAULT = "Other"
 
+# One pass for all occupation rules. Rules are listed in priority order; the
+# zero-width lookahead tries every start position without consuming text, so the
+# lowest-numbered group seen anywhere is exactly what the old if-chain returned.
+_OCC_RULES = [
+    ("swe", r"software|swe|developer|engineer|full\s*stack|backend|frontend", "Software Engineer"),
+    ("data", r"data|ml|ai|analytics|scientist|bi|machine learning", "Data / AI"),
+    ("design", r"design|ux|ui|product design", "Design"),
+    ("product", r"product\s*manager|pm|product\s*owner", "Product"),
+    ("devops", r"devops|infra|platform|site reliability|sre|cloud", "DevOps / Infra"),
+    ("security", r"security|infosec", "Security"),
+    ("student", r"student|intern", "Student / Intern"),
+    ("founder", r"founder|ceo|cto|coo|startup", "Founder"),
+]
+_OCC_RE = re.compile("(?=" + "|".join(f"(?P<{name}>{pat})" for name, pat, _ in _OCC_RULES) + ")")
+_OCC_LABEL = {name: label for name, _, label in _OCC_RULES}
+_OCC_RANK = {name: i for i, (name, _, _) in enumerate(_OCC_RULES)}
+
 def normalize_occ(s: Optional[str]) -> str:
     if not s:
         return OCC_DEFAULT
@@ -183,14 +337,14 @@ def normalize_occ(s: Optional[str]) -> str:
     if not t:
         return OCC_DEFAULT
     low = t.lower()
-    if re.search(r"(software|swe|developer|engineer|full\s*stack|backend|frontend)", low): return "Software Engineer"
-    if re.search(r"(data|ml|ai|analytics|scientist|bi|machine learning)", low): return "Data / AI"
-    if re.search(r"(design|ux|ui|product design)", low): return "Design"
-    if re.search(r"(product\s*manager|pm|product\s*owner)", low): return "Product"
-    if re.search(r"(devops|infra|platform|site reliability|sre|cloud)", low): return "DevOps / Infra"
-    if re.search(r"(security|infosec)", low): return "Security"
-    if re.search(r"(student|intern)", low): return "Student / Intern"
-    if re.search(r"(founder|ceo|cto|coo|startup)", low): return "Founder"
+    best = None
+    for m in _OCC_RE.finditer(low):
+        if best is None or _OCC_RANK[m.lastgroup] < _OCC_RANK[best]:
+            best = m.lastgroup
+            if _OCC_RANK[best] == 0:
+                break
+    if best is not None:
+        return _OCC_LABEL[best]
     return t[:1].upper() + t[1:]
 
 def title_case(s: str) -> str:
@@ -215,6 +369,27 @@ KW = [
     "product","pm"
 ]
 
+# Aho-Corasick (optional): every KW occurrence in one pass over the text
+try:
+    import ahocorasick
+    _KW_AC = ahocorasick.Automaton()
+    for _i, _k in enumerate(KW):
+        _KW_AC.add_word(_k, _i)
+    _KW_AC.make_automaton()
+    _AC_OK = True
+except Exception:
+    _KW_AC = None
+    _AC_OK = False
+
+def _kw_hits(txt: str) -> List[str]:
+    """Keywords of KW occurring in txt, in KW order."""
+    if _AC_OK:
+        return [KW[i] for i in sorted({i for _, i in _KW_AC.iter(txt)})]
+    return [k for k in KW if k in txt]
+
+_OCC_SPLIT_RE = re.compile(r"[,/|•·\-]+")
+_TOKENIZE_RE = re.compile(r"[^a-z0-9\s+.]")
+
 def derive_interests(p: dict) -> List[str]:
     out: List[str] = []
     def push_arr(arr):
@@ -228,16 +403,22 @@ def derive_interests(p: dict) -> List[str]:
     push_arr(p.get("tags"))
     push_arr(p.get("topics"))
     txt = " ".join([p.get("headline") or "", p.get("bio") or "", p.get("occupation") or ""]).lower()
-    for k in KW:
-        if k in txt:
-            out.append(k)
+    out.extend(_kw_hits(txt))
     if not out and p.get("occupation"):
-        bits = [b.strip() for b in re.split(r"[,/|•·\-]+", p["occupation"]) if b.strip()]
+        bits = [b.strip() for b in _OCC_SPLIT_RE.split(p["occupation"]) if b.strip()]
         out.extend(bits[:3])
     return list(dict.fromkeys([title_case(x) for x in out]))[:40]
 
+# ASCII fast path for tokenize: byte -> lowercased byte if in [a-z0-9+.], else space
+_TOK_TABLE = bytes(
+    ord(chr(c).lower()) if chr(c).lower() in "abcdefghijklmnopqrstuvwxyz0123456789+." else 0x20
+    for c in range(256)
+)
+
 def tokenize(s: str) -> List[str]:
-    return [t for t in re.sub(r"[^a-z0-9\s+.]", " ", s.lower()).split() if t]
+    if s.isascii():
+        return [t.decode("ascii") for t in s.encode("ascii").translate(_TOK_TABLE).split()]
+    return [t for t in _TOKENIZE_RE.sub(" ", s.lower()).split() if t]
 
 SYN: Dict[str, List[str]] = {
     "backend": ["server", "api", "microservices", "distributed", "scalable", "rest", "grpc"],
@@ -249,23 +430,34 @@ SYN: Dict[str, List[str]] = {
     "security": ["infosec", "iam", "oauth", "owasp", "threat", "detection"],
 }
 
-def expand_tokens(tokens: List[str]) -> List[str]:
+# token -> every SYN cluster (key + values) it belongs to, built once
+_TOKEN_TO_EXPANSION: Dict[str, frozenset] = {}
+for _k, _vals in SYN.items():
+    _cluster = frozenset([_k, *_vals])
+    for _t in _cluster:
+        _TOKEN_TO_EXPANSION[_t] = _TOKEN_TO_EXPANSION.get(_t, frozenset()) | _cluster
+_EMPTY: frozenset = frozenset()
+
+def expand_tokens(tokens: List[str]) -> Set[str]:
     out: Set[str] = set(tokens)
     for t in tokens:
-        for k, vals in SYN.items():
-            if t == k or t in vals:
-                out.add(k)
-                out.update(vals)
-    return list(out)
-
-def score_text(qtoks: List[str], target: str) -> float:
-    ttoks = expand_tokens(tokenize(target))
-    s = 0.0
-    for q in qtoks:
-        if q in ttoks:
-            s += 2.0
-        elif any(q in t or t in q for t in ttoks):
-            s += 1.0
+        out |= _TOKEN_TO_EXPANSION.get(t, _EMPTY)
+    return out
+
+@lru_cache(maxsize=4096)
+def _target_tokens(s: str) -> frozenset:
+    """Expanded token set of a label; labels repeat across items and requests."""
+    return frozenset(expand_tokens(tokenize(s)))
+
+def score_text(q_set: Set[str], t_set: frozenset) -> float:
+    """2 per exact token match, 1 per remaining query token that is a substring either way."""
+    exact = q_set & t_set
+    s = 2.0 * len(exact)
+    for q in q_set - exact:
+        for t in t_set:
+            if q in t or t in q:
+                s += 1.0
+                break
     return s
 
 # ------------------------------------------------------------------------------
@@ -291,23 +483,72 @@ GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
 GOOGLE_API_KEY = (os.getenv("GOOGLE_API_KEY") or "").strip()
 
 MIN_SECONDS_BETWEEN_CALLS = 0.8
-_last_call_at: Dict[str, float] = {}
+# Last call per uid, LRU-bounded so memory tracks active users, not all users
+_MAX_RATE_ENTRIES = 50_000
+_last_call_at: "OrderedDict[str, float]" = OrderedDict()
+_last_call_lock = threading.Lock()
 
 def _rate_limit(uid: str):
     now = time.time()
-    last = _last_call_at.get(uid, 0.0)
-    if now - last < MIN_SECONDS_BETWEEN_CALLS:
-        raise RuntimeError("Please wait a moment before asking again.")
-    _last_call_at[uid] = now
+    with _last_call_lock:
+        last = _last_call_at.get(uid, 0.0)
+        if now - last < MIN_SECONDS_BETWEEN_CALLS:
+            raise RuntimeError("Please wait a moment before asking again.")
+        _last_call_at[uid] = now
+        _last_call_at.move_to_end(uid)
+        while len(_last_call_at) > _MAX_RATE_ENTRIES:
+            _last_call_at.popitem(last=False)
+
+_JSON_DECODER = json.JSONDecoder()
+
+def _extract_first_json(txt: str) -> Optional[dict]:
+    """
+    First complete JSON object in txt, ignoring any prose before or after it.
+    raw_decode parses forward from each '{' and stops at the matching '}'.
+    """
+    start = txt.find("{")
+    while start != -1:
+        try:
+            obj, _ = _JSON_DECODER.raw_decode(txt, start)
+            return obj
+        except ValueError:
+            start = txt.find("{", start + 1)
+    return None
+
+# blake2b(prompt) -> (stored_at, parsed JSON object); failures are not cached
+GEMINI_CACHE_MAX = 1024
+GEMINI_CACHE_TTL_SECONDS = 600.0
+_gemini_cache: "OrderedDict[bytes, Tuple[float, dict]]" = OrderedDict()
+_gemini_cache_lock = threading.Lock()
 
 def _call_gemini_json(prompt: str) -> Optional[dict]:
     """
     Calls Gemini and tries to parse a JSON object from the response.
     Returns None on parsing failure so caller can fallback.
+    Identical prompts within GEMINI_CACHE_TTL_SECONDS reuse the parsed object.
     """
     if not GOOGLE_API_KEY:
         raise RuntimeError("GOOGLE_API_KEY environment variable is not set")
 
+    key = hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).digest()
+    now = time.time()
+    with _gemini_cache_lock:
+        hit = _gemini_cache.get(key)
+        if hit and now - hit[0] <= GEMINI_CACHE_TTL_SECONDS:
+            _gemini_cache.move_to_end(key)
+            return copy.deepcopy(hit[1])
+
+    obj = _call_gemini_json_uncached(prompt)
+    if obj is not None:
+        with _gemini_cache_lock:
+            _gemini_cache[key] = (now, obj)
+            _gemini_cache.move_to_end(key)
+            while len(_gemini_cache) > GEMINI_CACHE_MAX:
+                _gemini_cache.popitem(last=False)
+        obj = copy.deepcopy(obj)
+    return obj
+
+def _call_gemini_json_uncached(prompt: str) -> Optional[dict]:
     raw_text = None
     try:
         if GENAI_MODE == "new" and NEW_GENAI is not None:
@@ -336,51 +577,90 @@ def _call_gemini_json(prompt: str) -> Optional[dict]:
                 "  pip install google-generativeai # legacy client"
             )
     except Exception as e:
-        print(f"[network.ai] Gemini error: {type(e).__name__}: {e}")
+        log.warning("Gemini error: %s: %s", type(e).__name__, e)
         return None
 
     if not raw_text or not raw_text.strip():
         return None
 
-    txt = raw_text.strip()
     # Extract the first JSON object from the response safely
-    m = re.search(r"\{.*\}", txt, flags=re.S)
-    if not m:
-        return None
-    try:
-        obj = json.loads(m.group(0))
-        if isinstance(obj, dict):
-            return obj
-    except Exception:
-        pass
-    return None
+    return _extract_first_json(raw_text)
 
 # ------------------------------------------------------------------------------
 # Local semantic fallback using provided context
 # ------------------------------------------------------------------------------
+@lru_cache(maxsize=1024)
+def _count_weight(count: Any) -> float:
+    """Interest weight for a popularity count (counts are small, repeated ints)."""
+    return max(1.0, math.log2(1 + int(count)))
+
+def _score_labels(qt: Set[str], labels: List[str]) -> List[float]:
+    """
+    score_text(qt, _target_tokens(label)) for every label at once, via an inverted
+    index token -> label positions. Only tokens related to some query token do any
+    work. Per label: score = |exact| + |query tokens related to any label token|,
+    which is score_text's 2 per exact match + 1 per substring-only match.
+    """
+    postings: Dict[str, List[int]] = {}
+    for i, label in enumerate(labels):
+        for t in _target_tokens(label):
+            postings.setdefault(t, []).append(i)
+
+    exact = array("d", [0.0]) * len(labels)
+    related: List[Optional[Set[str]]] = [None] * len(labels)
+    for t, idxs in postings.items():
+        rel = {q for q in qt if q in t or t in q}
+        if not rel:
+            continue
+        is_exact = t in qt
+        for i in idxs:
+            if is_exact:
+                exact[i] += 1.0
+            if related[i] is None:
+                related[i] = set(rel)
+            else:
+                related[i] |= rel
+    return [exact[i] + len(related[i] or ()) for i in range(len(labels))]
+
 def _local_match(q: str, extra: str, occs: List[str], interests_by_occ: Dict[str, List[Dict[str, Any]]]) -> Optional[Tuple[str, Optional[str], Dict[str, float]]]:
     qt = expand_tokens(tokenize((q or "") + "\n" + (extra or "")))
     if not qt or not occs:
         return None
 
-    # score occupations
-    best_occ, best_occ_s = None, -1.0
-    occ_scores: Dict[str, float] = {}
-    for o in occs:
-        s = score_text(qt, o)
+    # Every distinct label (occupations + their top interests) is scored once.
+    # (row, label, weight) triplets form a sparse occupation x label weight matrix.
+    label_idx: Dict[str, int] = {}
+    rows: List[int] = []
+    cols: List[int] = []
+    weights: List[float] = []
+    for r, o in enumerate(occs):
+        rows.append(r)
+        cols.append(label_idx.setdefault(o, len(label_idx)))
+        weights.append(1.0)
         for it in (interests_by_occ.get(o) or [])[:24]:
-            s += score_text(qt, it["label"]) * max(1.0, math.log2(1 + int(it.get("count", 1))))
-        occ_scores[o] = s
-        if s > best_occ_s:
-            best_occ_s, best_occ = s, o
+            rows.append(r)
+            cols.append(label_idx.setdefault(it["label"], len(label_idx)))
+            weights.append(_count_weight(it.get("count", 1)))
+    label_scores = np.asarray(_score_labels(qt, list(label_idx)), dtype=np.float64)
+
+    # score occupations: W @ label_scores in one pass (bincount adds in term order)
+    scores = np.bincount(
+        np.asarray(rows, dtype=np.intp),
+        weights=label_scores[np.asarray(cols, dtype=np.intp)] * np.asarray(weights, dtype=np.float64),
+        minlength=len(occs),
+    )
+    occ_scores: Dict[str, float] = dict(zip(occs, scores.tolist()))
+    best_occ = occs[int(scores.argmax())]
 
     if not best_occ:
         return None
 
     # score interests within the best occupation
+    items = interests_by_occ.get(best_occ) or []
+    item_scores = _score_labels(qt, [it["label"] for it in items])
     best_i, best_i_s = None, -1.0
-    for it in (interests_by_occ.get(best_occ) or []):
-        s = score_text(qt, it["label"]) * max(1.0, math.log2(1 + int(it.get("count", 1))))
+    for it, base in zip(items, item_scores):
+        s = base * _count_weight(it.get("count", 1))
         if s > best_i_s:
             best_i_s, best_i = s, it["label"]
 
@@ -1,38 +1,36 @@
 # profiles.py
 from __future__ import annotations
 
-import os
+import random
 import re
-from typing import Any, Dict, Optional, Tuple, Iterable, List
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, TypedDict, cast
 
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
+from firebase_admin import firestore
+from google.api_core import exceptions as gexc, retry as gretry
 from google.cloud.firestore_v1 import Transaction
 
-from datetime import datetime
-from typing import TypedDict, List, Optional, Dict, Any
-from typing import cast
-
+from common import get_db, stream_paged, verify_id_token
+import network
 
 # ------------------------------------------------------------
 # Firebase / Firestore init
 # ------------------------------------------------------------
 
-SERVICE_ACCOUNT_PATH = os.getenv(
-    "GOOGLE_APPLICATION_CREDENTIALS",
-    "neru-b3128-firebase-adminsdk-fbsvc-11110f3ad3.json",
-)
-
-def _ensure_firebase() -> None:
-    if not firebase_admin._apps:
-        cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
-        firebase_admin.initialize_app(cred)
+# Resolved on first use (not at import) via the shared process-wide client
+_db = get_db
 
-def _get_db():
-    _ensure_firebase()
-    return firestore.client()
+def _users():
+    return _db().collection("users")
 
-db = _get_db()
+# slugs/{slug} -> {"uid": ...}: direct-get index in front of the users slug query
+def _slugs():
+    return _db().collection("slugs")
 
 # ------------------------------------------------------------
 # Slug helpers (pure functions)
@@ -42,8 +40,20 @@ _slug_strip_re = re.compile(r"[^a-zA-Z0-9\s-]")
 _spaces_re = re.compile(r"\s+")
 _dashes_re = re.compile(r"-+")
 
+# ASCII fast path: delete everything but letters, digits, whitespace and '-'
+_SLUG_KEEP = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-") | {
+    chr(c) for c in range(128) if chr(c).isspace()
+}
+_SLUG_TRANS = str.maketrans("", "", "".join(chr(c) for c in range(128) if chr(c) not in _SLUG_KEEP))
+
+# Pure str -> str, and the same names come through on every page view and backfill
+@lru_cache(maxsize=8192)
 def kebab_any(s: str) -> str:
-    s = _slug_strip_re.sub("", s or "").lower()
+    s = s or ""
+    if s.isascii():
+        # Whitespace and dash runs both collapse to one '-'; no regex passes
+        return "-".join(s.translate(_SLUG_TRANS).lower().replace("-", " ").split())
+    s = _slug_strip_re.sub("", s).lower()
     s = _spaces_re.sub("-", s)
     s = _dashes_re.sub("-", s)
     return s.strip("-")
@@ -53,10 +63,14 @@ def kebab_name(first: Optional[str], last: Optional[str] = None) -> str:
     return kebab_any(full)
 
 def derive_slug(user: Dict[str, Any]) -> Optional[str]:
-    fn = (user.get("firstName") or "").strip()
-    ln = (user.get("lastName") or "").strip()
-    full = (user.get("fullName") or "").strip()
+    return _derive_slug(
+        (user.get("firstName") or "").strip(),
+        (user.get("lastName") or "").strip(),
+        (user.get("fullName") or "").strip(),
+    )
 
+@lru_cache(maxsize=8192)
+def _derive_slug(fn: str, ln: str, full: str) -> Optional[str]:
     if fn or ln:
         return kebab_name(fn, ln)
 
@@ -72,6 +86,27 @@ def derive_slug(user: Dict[str, Any]) -> Optional[str]:
 
     return None
 
+def slug_aliases(user: Dict[str, Any]) -> List[str]:
+    """
+    Every slug a profile URL may use for this user (stored slug, first+last,
+    fullName, split fullName). Persisted as `slugAliases` so lookups stay indexed.
+    """
+    out: List[str] = []
+    s = (user.get("slug") or "").lower().strip()
+    if s:
+        out.append(s)
+    fn = (user.get("firstName") or "").strip()
+    ln = (user.get("lastName") or "").strip()
+    if fn or ln:
+        out.append(kebab_name(fn, ln))
+    full = (user.get("fullName") or "").strip()
+    if full:
+        out.append(kebab_any(full))
+        parts = full.split()
+        if parts and not (fn or ln):
+            out.append(kebab_name(parts[0], " ".join(parts[1:]) or None))
+    return [a for a in dict.fromkeys(out) if a]
+
 # ------------------------------------------------------------
 # Auth helper (no Flask dependency)
 # ------------------------------------------------------------
@@ -79,13 +114,16 @@ def derive_slug(user: Dict[str, Any]) -> Optional[str]:
 def verify_bearer_uid(authorization_header: Optional[str]) -> Optional[str]:
     """
     Parse 'Authorization: Bearer <idToken>' and verify with Firebase.
+    Verified claims are cached until the token expires (see common.verify_id_token).
     Returns UID or None.
     """
     if not authorization_header or not authorization_header.startswith("Bearer "):
         return None
-    id_token = authorization_header.split("Bearer ", 1)[1].strip()
+    id_token = authorization_header[7:].strip()
+    if not id_token:
+        return None
     try:
-        decoded = auth.verify_id_token(id_token)
+        decoded = verify_id_token(id_token)
         return decoded.get("uid")
     except Exception:
         return None
@@ -95,95 +133,366 @@ def verify_bearer_uid(authorization_header: Optional[str]) -> Optional[str]:
 # ------------------------------------------------------------
 
 def _get_user_doc(uid: str):
-    return db.collection("users").document(uid)
+    return _users().document(uid)
+
+# users/{uid} fields the SPA's ProfileData reads (plus what derive_slug needs)
+PROFILE_FIELDS = [
+    "firstName", "lastName", "fullName", "headline", "location", "occupation",
+    "avatarUrl", "bio", "slug", "stats", "followersCount", "following", "followersDetails",
+]
+
+# Short-lived read cache for follow/auth paths. Writes made through this module
+# invalidate it; anything else (e.g. client-side setDoc) shows up within the TTL.
+# uid -> (stored_at, {projection or None for full doc: user dict})
+USER_CACHE_TTL_SECONDS = 60.0
+USER_CACHE_MAX = 10_000
+_user_cache: "OrderedDict[str, Tuple[float, Dict[Optional[Tuple[str, ...]], Dict[str, Any]]]]" = OrderedDict()
+# slug -> (stored_at, uid); hits are re-validated against the cached user.
+# uid None caches a miss so unknown slugs don't repeat the index gets, queries
+# and fallback scan on every request
+_slug_cache: "OrderedDict[str, Tuple[float, Optional[str]]]" = OrderedDict()
+# uid -> (stored_at, follower shard total, recent followers) for with_follower_stats
+_follower_stats_cache: "OrderedDict[str, Tuple[float, int, List[Dict[str, Any]]]]" = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+def _user_cache_get(uid: str, key: Optional[Tuple[str, ...]]) -> Optional[Dict[str, Any]]:
+    with _user_cache_lock:
+        hit = _user_cache.get(uid)
+        if not hit:
+            return None
+        if time.time() - hit[0] > USER_CACHE_TTL_SECONDS:
+            del _user_cache[uid]
+            return None
+        _user_cache.move_to_end(uid)
+        user = hit[1].get(key)
+        if user is None and key is not None and None in hit[1]:
+            full = hit[1][None]
+            user = {k: full[k] for k in key if k in full}
+            user["id"] = uid
+        return dict(user) if user is not None else None
+
+def _user_cache_put(uid: str, key: Optional[Tuple[str, ...]], user: Dict[str, Any]) -> None:
+    now = time.time()
+    with _user_cache_lock:
+        hit = _user_cache.get(uid)
+        if not hit or now - hit[0] > USER_CACHE_TTL_SECONDS:
+            hit = (now, {})
+            _user_cache[uid] = hit
+        hit[1][key] = dict(user)
+        _user_cache.move_to_end(uid)
+        while len(_user_cache) > USER_CACHE_MAX:
+            _user_cache.popitem(last=False)
+
+def _slug_cache_put(slug: str, uid: Optional[str]) -> None:
+    with _user_cache_lock:
+        _slug_cache[slug] = (time.time(), uid)
+        _slug_cache.move_to_end(slug)
+        while len(_slug_cache) > USER_CACHE_MAX:
+            _slug_cache.popitem(last=False)
+
+def _forget_slugs(slugs: Iterable[str]) -> None:
+    """Drop cached slug entries (e.g. a cached miss for a slug a user just took)."""
+    with _user_cache_lock:
+        for s in slugs:
+            _slug_cache.pop(s, None)
+
+def invalidate_user_cache(*uids: str) -> None:
+    """Drop cached docs for these uids (all of them when called with none), here and in network."""
+    network.clear_network_cache(*uids)
+    with _user_cache_lock:
+        if not uids:
+            _user_cache.clear()
+            _slug_cache.clear()
+            _follower_stats_cache.clear()
+            return
+        for uid in uids:
+            _user_cache.pop(uid, None)
+            _follower_stats_cache.pop(uid, None)
+
+# followersCount is split over users/{uid}/counters/{0..N-1}: each follow bumps one
+# random shard, so a popular target doesn't serialize every follow on one field.
+# The doc's own followersCount (or legacy stats.followers) is the frozen base.
+FOLLOWER_SHARDS = 10
+
+def _follower_shard(uid: str):
+    return _get_user_doc(uid).collection("counters").document(str(random.randrange(FOLLOWER_SHARDS)))
+
+def _follower_shard_total(uid: str) -> int:
+    """Sum of the followers counter shards (one get_all)."""
+    shards = _get_user_doc(uid).collection("counters")
+    return sum(
+        _safe_int((snap.to_dict() or {}).get("followers"))
+        for snap in _db().get_all([shards.document(str(i)) for i in range(FOLLOWER_SHARDS)])
+        if snap.exists
+    )
 
-def get_user_by_uid(uid: str) -> Optional[Dict[str, Any]]:
-    doc = _get_user_doc(uid).get()
+# users/{uid}/followers/{follower_uid} -> {uid, fullName, slug, createdAt}: one small
+# doc per follower instead of an ever-growing followersDetails array on the user doc
+FOLLOWERS_DETAILS_LIMIT = 50
+
+def _followers_details_ref(uid: str, follower_uid: str):
+    return _get_user_doc(uid).collection("followers").document(follower_uid)
+
+def _recent_followers(uid: str) -> List[Dict[str, Any]]:
+    """The newest FOLLOWERS_DETAILS_LIMIT entries of the followers subcollection."""
+    q = (
+        _get_user_doc(uid).collection("followers")
+        .order_by("createdAt", direction=firestore.Query.DESCENDING)
+        .limit(FOLLOWERS_DETAILS_LIMIT)
+    )
+    recent = []
+    for d in q.stream():
+        e = d.to_dict() or {}
+        recent.append({"uid": e.get("uid") or d.id, "fullName": e.get("fullName"), "slug": e.get("slug")})
+    return recent
+
+def with_follower_stats(uid: str, user: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Copy of user with the counter shards folded into followersCount and the
+    most recent FOLLOWERS_DETAILS_LIMIT followers (newest first) merged into
+    followersDetails after the legacy inline entries. Only profile views need
+    these, so plain user reads skip both lookups.
+    """
+    now = time.time()
+    with _user_cache_lock:
+        hit = _follower_stats_cache.get(uid)
+    if hit and now - hit[0] <= USER_CACHE_TTL_SECONDS:
+        _, shard_total, recent = hit
+    else:
+        shard_total, recent = _follower_shard_total(uid), _recent_followers(uid)
+        with _user_cache_lock:
+            _follower_stats_cache[uid] = (now, shard_total, recent)
+            _follower_stats_cache.move_to_end(uid)
+            while len(_follower_stats_cache) > USER_CACHE_MAX:
+                _follower_stats_cache.popitem(last=False)
+
+    out = dict(user)
+    out["followersCount"] = max(0, _followers_count(user) + shard_total)
+    seen = {e["uid"] for e in recent}
+    legacy = [e for e in (user.get("followersDetails") or []) if e.get("uid") not in seen]
+    out["followersDetails"] = (legacy + list(recent))[:FOLLOWERS_DETAILS_LIMIT]
+    return out
+
+def get_user_by_uid(uid: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    """users/{uid} as a dict with "id"; `fields` projects the read server-side."""
+    key = tuple(fields) if fields else None
+    cached = _user_cache_get(uid, key)
+    if cached is not None:
+        return cached
+    doc = _get_user_doc(uid).get(field_paths=fields) if fields else _get_user_doc(uid).get()
     if not doc.exists:
         return None
     user = doc.to_dict() or {}
     user["id"] = uid
+    _user_cache_put(uid, key, user)
     return user
 
+def get_about(uid: str) -> Dict[str, Any]:
+    """users/{uid}/about/main as a dict ({} when missing)."""
+    snap = _get_user_doc(uid).collection("about").document("main").get()
+    return (snap.to_dict() or {}) if snap.exists else {}
+
+def _index_slug(uid: str, slug: str, batch=None) -> None:
+    if not slug:
+        return
+    ref = _slugs().document(slug)
+    if batch is not None:
+        batch.set(ref, {"uid": uid})
+    else:
+        ref.set({"uid": uid})
+
+# users/{uid}.searchNgrams: every 2-4 char substring of the lowercased full name,
+# so substring search is one array-contains query. Names past
+# SEARCH_NGRAM_NAME_MAX chars are cut, which keeps the array (and its index
+# entries) to a few hundred values per user.
+SEARCH_NGRAM_MIN = 2
+SEARCH_NGRAM_MAX = 4
+SEARCH_NGRAM_NAME_MAX = 64
+
+def name_ngrams(full_lower: str) -> List[str]:
+    """Distinct 2-4 char substrings of an already-lowercased name, in first-seen order."""
+    s = (full_lower or "").strip()[:SEARCH_NGRAM_NAME_MAX]
+    return list(dict.fromkeys(
+        s[i:i + n]
+        for i in range(len(s))
+        for n in range(SEARCH_NGRAM_MIN, SEARCH_NGRAM_MAX + 1)
+        if i + n <= len(s)
+    ))
+
+_NAME_CLEAN_RE = re.compile(r"[^a-zA-Z0-9\s-]")
+
+def name_tokens(full_name: str) -> List[str]:
+    """
+    Break a name into lowercased tokens plus progressive prefixes for quick search.
+    e.g. "Diego Cicotoste" -> ["diego","di","die","dieg","cicotoste","ci","cic","cico",...]
+    """
+    parts = _NAME_CLEAN_RE.sub(" ", full_name or "").lower().split()
+    # dict.fromkeys de-dupes while preserving order
+    return list(dict.fromkeys(
+        t for p in parts for t in (p, *(p[:k] for k in range(2, min(len(p), 6) + 1)))
+    ))
+
+def search_full_name(user: Dict[str, Any]) -> str:
+    """The name search matches against (same rule as search.ensure_user_search_fields)."""
+    return user.get("fullName") or " ".join([user.get("firstName", "") or "", user.get("lastName", "") or ""]).strip()
+
 def _fast_lookup_by_slug(target: str) -> Optional[Tuple[str, Dict[str, Any]]]:
-    users = list(db.collection("users").where("slug", "==", target).limit(1).stream())
+    # 1) slugs/{slug} -> users/{uid}: two direct gets, no index scan
+    idx = _slugs().document(target).get()
+    uid = (idx.to_dict() or {}).get("uid") if idx.exists else None
+    if uid:
+        doc = _get_user_doc(uid).get()
+        u = (doc.to_dict() or {}) if doc.exists else None
+        # Ignore stale entries (user renamed / deleted)
+        if u is not None and (u.get("slug") or "").lower() == target:
+            u["id"] = uid
+            return (uid, u)
+
+    # 2) Users not indexed yet: query, then index for next time.
+    #    slugAliases covers name-derived slugs that used to need a full scan.
+    users = list(_users().where("slug", "==", target).limit(1).stream())
     if not users:
-        return None
+        users = list(_users().where("slugAliases", "array_contains", target).limit(1).stream())
+        if not users:
+            return _recent_unindexed_user(target)
+        doc = users[0]
+        u = doc.to_dict() or {}
+        u["id"] = doc.id
+        return (doc.id, u)
     doc = users[0]
     u = doc.to_dict() or {}
     u["id"] = doc.id
+    try:
+        _index_slug(doc.id, target)
+    except Exception:
+        pass
     return (doc.id, u)
 
-def _slow_scan_users() -> Iterable[Tuple[str, Dict[str, Any]]]:
-    for doc in db.collection("users").stream():
-        u = doc.to_dict() or {}
-        u["id"] = doc.id
-        yield (doc.id, u)
+# Newest users checked when no index matches. Accounts written by the client
+# (onboarding's setDoc) carry no slug/slugAliases until ensure_user_slug or
+# backfill_all_slugs runs, and they are the newest ones.
+SLUG_FALLBACK_SCAN = 200
+
+def _recent_unindexed_user(target: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Match target against the newest users lacking slugAliases; index the hit."""
+    q = (
+        _users().select(SLUG_SOURCE_FIELDS + ["slugAliases"])
+        .order_by("createdAt", direction=firestore.Query.DESCENDING)
+        .limit(SLUG_FALLBACK_SCAN)
+    )
+    uid = None
+    for d in q.stream():
+        data = d.to_dict() or {}
+        if not data.get("slugAliases") and target in slug_aliases(data):
+            uid = d.id
+            break
+    if uid is None:
+        return None
+    doc = _get_user_doc(uid).get()
+    if not doc.exists:
+        return None
+    u = doc.to_dict() or {}
+    u["id"] = uid
+    patch: Dict[str, Any] = {}
+    if not u.get("slug"):
+        s = derive_slug(u)
+        if s:
+            u["slug"] = patch["slug"] = s
+    u["slugAliases"] = patch["slugAliases"] = slug_aliases(u)
+    try:
+        _get_user_doc(uid).update(patch)
+        if u.get("slug"):
+            _index_slug(uid, u["slug"].lower())
+        _forget_slugs(u["slugAliases"])
+    except Exception:
+        pass
+    return (uid, u)
 
 def get_user_by_slug(slug: str) -> Optional[Dict[str, Any]]:
     """
     Resolve a user by slug via:
-      1) fast slug index
-      2) scan & compute fallbacks
+      1) slugs/{slug} index
+      2) indexed equality on slug, then array_contains on slugAliases
+      3) the newest SLUG_FALLBACK_SCAN users that have no slugAliases yet
+    Older users written before slugAliases existed resolve once backfill_all_slugs has run.
     """
     target = (slug or "").lower().strip()
     if not target:
         return None
 
+    with _user_cache_lock:
+        hit = _slug_cache.get(target)
+    if hit and time.time() - hit[0] <= USER_CACHE_TTL_SECONDS:
+        if hit[1] is None:
+            return None
+        u = get_user_by_uid(hit[1])
+        # Renamed since it was cached: fall through to a fresh lookup
+        if u is not None and target in slug_aliases(u):
+            return u
+
     try:
         fast = _fast_lookup_by_slug(target)
         if fast:
-            return fast[1]
-    except Exception:
-        pass
-
-    for _id, u in _slow_scan_users():
-        s = (u.get("slug") or "").lower().strip()
-        if s and s == target:
+            uid, u = fast
+            _user_cache_put(uid, None, u)
+            _slug_cache_put(target, uid)
             return u
-
-        fn = (u.get("firstName") or "").strip()
-        ln = (u.get("lastName") or "").strip()
-        if fn or ln:
-            if kebab_name(fn, ln) == target:
-                return u
-
-        full = (u.get("fullName") or "").strip()
-        if full and kebab_any(full) == target:
-            return u
-
-        if full and not (fn or ln):
-            parts = full.split()
-            if parts:
-                first = parts[0]
-                rest = " ".join(parts[1:]) if len(parts) > 1 else None
-                if kebab_name(first, rest) == target:
-                    return u
-
+    except Exception:
+        # Lookup failed (not a miss): don't cache it
+        return None
+    _slug_cache_put(target, None)
     return None
 
 def ensure_user_slug(uid: str, user: Dict[str, Any]) -> Dict[str, Any]:
+    """Ensure a 'slug' exists for this user; if missing, derive and persist it."""
     if user.get("slug"):
         return user
     s = derive_slug(user)
     if s:
-        _get_user_doc(uid).update({"slug": s})
         user["slug"] = s
+        aliases = slug_aliases(user)
+        _get_user_doc(uid).update({"slug": s, "slugAliases": aliases})
+        _index_slug(uid, s)
+        invalidate_user_cache(uid)
+        _forget_slugs(aliases)
     return user
 
+# Fields derive_slug / slug_aliases depend on
+SLUG_SOURCE_FIELDS = ["slug", "firstName", "lastName", "fullName"]
+
 def upsert_user(uid: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Merge `data` into users/{uid}. set(merge=True) already merges field-by-field,
+    so the doc is only read (just the name fields) when `data` touches the slug inputs.
+    Returns what was written, with "id".
+    """
     doc_ref = _get_user_doc(uid)
-    existing = doc_ref.get().to_dict() or {}
-    merged = {**existing, **(data or {})}
-
-    if not merged.get("slug"):
-        s = derive_slug(merged)
-        if s:
-            merged["slug"] = s
-
-    doc_ref.set(merged, merge=True)
-    merged["id"] = uid
-    return merged
+    out = dict(data or {})
+    batch = _db().batch()
+
+    if any(k in out for k in SLUG_SOURCE_FIELDS):
+        existing = doc_ref.get(field_paths=SLUG_SOURCE_FIELDS).to_dict() or {}
+        merged = {**existing, **out}
+        if not merged.get("slug"):
+            s = derive_slug(merged)
+            if s:
+                merged["slug"] = out["slug"] = s
+        out["slugAliases"] = slug_aliases(merged)
+        # Search fields are derived here, once per write, not per search hit
+        full = search_full_name(merged)
+        out["fullNameLower"] = full.lower()
+        out["nameTokens"] = name_tokens(full)
+        out["searchNgrams"] = name_ngrams(out["fullNameLower"])
+
+    # User doc and slug index land together in one commit
+    batch.set(doc_ref, out, merge=True)
+    if out.get("slug"):
+        _index_slug(uid, out["slug"].lower(), batch)
+    batch.commit()
+    invalidate_user_cache(uid)
+    _forget_slugs(out.get("slugAliases") or [])
+    out["id"] = uid
+    return out
 
 # ------------------------------------------------------------
 # Follows: helpers
@@ -217,196 +526,249 @@ def _ensure_slug_in_user(user: Dict[str, Any]) -> str:
     # derive from available names
     return derive_slug(user) or ""
 
-def _upsert_follower_details(
-    current: List[Dict[str, Any]],
-    new_entry: Dict[str, Any],
-) -> List[Dict[str, Any]]:
-    uid = new_entry.get("uid")
-    out: List[Dict[str, Any]] = []
-    seen = False
-    for e in current or []:
-        if e.get("uid") == uid:
-            # replace with latest info (name/slug might have changed)
-            out.append(new_entry)
-            seen = True
-        else:
-            out.append(e)
-    if not seen:
-        out.append(new_entry)
-    return out
+def _followers_count(user: Dict[str, Any]) -> int:
+    return _safe_int(user.get("followersCount") or user.get("stats", {}).get("followers") or 0)
 
-def _remove_follower_details(
-    current: List[Dict[str, Any]],
-    rm_uid: str,
-) -> List[Dict[str, Any]]:
-    return [e for e in (current or []) if e.get("uid") != rm_uid]
+# What _follower_entry reads from the viewer
+FOLLOWER_ENTRY_FIELDS = ["firstName", "lastName", "fullName", "slug", "email"]
+
+def _follower_entry(viewer_uid: str, viewer: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "uid": viewer_uid,
+        "fullName": _best_full_name(viewer),
+        "slug": _ensure_slug_in_user(viewer),
+    }
 
 def is_following(viewer_uid: str, target_uid: str) -> bool:
     if not viewer_uid or not target_uid:
         return False
-    viewer = get_user_by_uid(viewer_uid)
+    # Existence-only probe (empty field mask) of the follower subdoc written on follow
+    if _followers_details_ref(target_uid, viewer_uid).get(field_paths=[]).exists:
+        return True
+    # Follows made before the subcollection live only in the viewer's array
+    viewer = get_user_by_uid(viewer_uid, ["following"])
     if not viewer:
         return False
-    following = set(viewer.get("following") or [])
-    return target_uid in following
+    return target_uid in (viewer.get("following") or [])
 
 # ------------------------------------------------------------
 # Follows: transactional ops (adds followersDetails)
 # ------------------------------------------------------------
+# Both users' existence is checked by the callers (cached reads) before the
+# transaction. Only the viewer doc is read (and so locked) in it; the target,
+# which may be a hot doc with many concurrent followers, is not written at all:
+# its count goes to a random shard and the follower itself to a subdoc.
 
 @firestore.transactional
-def _tx_follow(transaction: Transaction, viewer_uid: str, target_uid: str) -> Dict[str, Any]:
+def _tx_follow(
+    transaction: Transaction, viewer_uid: str, target: Dict[str, Any], follower_entry: Dict[str, Any],
+) -> bool:
+    """Returns True when this call created the follow (False if it already existed)."""
     viewer_ref = _get_user_doc(viewer_uid)
-    target_ref = _get_user_doc(target_uid)
-
-    viewer_snap = viewer_ref.get(transaction=transaction)
-    target_snap = target_ref.get(transaction=transaction)
-    if not viewer_snap.exists or not target_snap.exists:
-        raise ValueError("user not found")
-
-    viewer = viewer_snap.to_dict() or {}
-    target = target_snap.to_dict() or {}
 
-    # viewer: following[]
-    viewer_following = set(viewer.get("following") or [])
+    # Membership is all the transaction needs; names/slug come in via follower_entry
+    viewer_snap = viewer_ref.get(field_paths=["following"], transaction=transaction)
+    if target["id"] in ((viewer_snap.to_dict() or {}).get("following") or []):
+        return False
 
-    # target: followers[], followersCount, followersDetails[]
-    target_followers = set(target.get("followers") or [])
-    followers_count = _safe_int(
-        target.get("followersCount") or target.get("stats", {}).get("followers") or 0
+    transaction.update(viewer_ref, {"following": firestore.ArrayUnion([target["id"]])})
+    transaction.set(
+        _followers_details_ref(target["id"], viewer_uid),
+        {**follower_entry, "createdAt": firestore.SERVER_TIMESTAMP},
     )
-    followers_details: List[Dict[str, Any]] = list(target.get("followersDetails") or [])
-
-    if target_uid not in viewer_following:
-        viewer_following.add(target_uid)
-        target_followers.add(viewer_uid)
-        followers_count += 1
-
-        # build/refresh follower detail entry from viewer's info
-        follower_name = _best_full_name(viewer)
-        follower_slug = _ensure_slug_in_user(viewer)
-        follower_entry = {
-            "uid": viewer_uid,
-            "fullName": follower_name,
-            "slug": follower_slug,
-        }
-        followers_details = _upsert_follower_details(followers_details, follower_entry)
-
-        # Persist
-        transaction.update(viewer_ref, {"following": list(viewer_following)})
-        transaction.update(target_ref, {
-            "followers": list(target_followers),
-            "followersCount": followers_count,
-            "followersDetails": followers_details,
-        })
-
-    return {"isFollowing": True, "followersCount": followers_count}
+    transaction.set(_follower_shard(target["id"]), {"followers": firestore.Increment(1)}, merge=True)
+    return True
 
 @firestore.transactional
-def _tx_unfollow(transaction: Transaction, viewer_uid: str, target_uid: str) -> Dict[str, Any]:
+def _tx_unfollow(transaction: Transaction, viewer_uid: str, target: Dict[str, Any]) -> bool:
+    """Returns True when this call removed the follow (False if there was none)."""
     viewer_ref = _get_user_doc(viewer_uid)
-    target_ref = _get_user_doc(target_uid)
-
-    viewer_snap = viewer_ref.get(transaction=transaction)
-    target_snap = target_ref.get(transaction=transaction)
-    if not viewer_snap.exists or not target_snap.exists:
-        raise ValueError("user not found")
 
-    viewer = viewer_snap.to_dict() or {}
-    target = target_snap.to_dict() or {}
-
-    viewer_following = set(viewer.get("following") or [])
-    target_followers = set(target.get("followers") or [])
-    followers_count = _safe_int(
-        target.get("followersCount") or target.get("stats", {}).get("followers") or 0
-    )
-    followers_details: List[Dict[str, Any]] = list(target.get("followersDetails") or [])
-
-    if target_uid in viewer_following:
-        viewer_following.remove(target_uid)
-        if viewer_uid in target_followers:
-            target_followers.remove(viewer_uid)
-        followers_count = max(0, followers_count - 1)
+    viewer_snap = viewer_ref.get(field_paths=["following"], transaction=transaction)
+    if target["id"] not in ((viewer_snap.to_dict() or {}).get("following") or []):
+        return False
 
-        # remove the viewer from followersDetails
-        followers_details = _remove_follower_details(followers_details, viewer_uid)
+    # Follows made before the subcollection may still sit in the inline arrays;
+    # only then does the target doc itself get written
+    target_update: Dict[str, Any] = {}
+    if viewer_uid in (target.get("followers") or []):
+        target_update["followers"] = firestore.ArrayRemove([viewer_uid])
+    legacy = [e for e in (target.get("followersDetails") or []) if e.get("uid") == viewer_uid]
+    if legacy:
+        target_update["followersDetails"] = firestore.ArrayRemove(legacy)
+
+    transaction.update(viewer_ref, {"following": firestore.ArrayRemove([target["id"]])})
+    if target_update:
+        transaction.update(_get_user_doc(target["id"]), target_update)
+    transaction.delete(_followers_details_ref(target["id"], viewer_uid))
+    transaction.set(_follower_shard(target["id"]), {"followers": firestore.Increment(-1)}, merge=True)
+    return True
+
+# @firestore.transactional gives up after a few ABORTED attempts; under a burst
+# of follows, retry the whole transaction with backoff + jitter before failing
+_FOLLOW_RETRY = gretry.Retry(
+    predicate=gretry.if_exception_type(gexc.Aborted, gexc.DeadlineExceeded),
+    initial=0.1,
+    maximum=2.0,
+    multiplier=2.0,
+    deadline=30.0,
+)
 
-        transaction.update(viewer_ref, {"following": list(viewer_following)})
-        transaction.update(target_ref, {
-            "followers": list(target_followers),
-            "followersCount": followers_count,
-            "followersDetails": followers_details,
-        })
+def _run_follow_tx(tx_fn, *args) -> bool:
+    return _FOLLOW_RETRY(lambda: tx_fn(_db().transaction(), *args))()
 
-    return {"isFollowing": False, "followersCount": followers_count}
+# The target (by slug) and viewer lookups are independent reads: overlap them
+_follow_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="follow")
 
-def follow_user(viewer_uid: str, target_slug: str) -> Dict[str, Any]:
+def _resolve_follow_pair(viewer_uid: str, target_slug: str, verb: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """(target, viewer) for a follow/unfollow, raising the usual errors."""
     if not viewer_uid:
         raise PermissionError("unauthorized")
+    viewer_f = _follow_pool.submit(get_user_by_uid, viewer_uid, FOLLOWER_ENTRY_FIELDS)
     target = get_user_by_slug(target_slug)
+    viewer = viewer_f.result()
     if not target:
         raise LookupError("target not found")
+    if target["id"] == viewer_uid:
+        raise ValueError(f"cannot {verb} yourself")
+    if not viewer:
+        raise ValueError("user not found")
+    return target, viewer
+
+def follow_user(viewer_uid: str, target_slug: str) -> Dict[str, Any]:
+    target, viewer = _resolve_follow_pair(viewer_uid, target_slug, "follow")
     target_uid = target["id"]
-    if target_uid == viewer_uid:
-        raise ValueError("cannot follow yourself")
-    tx = db.transaction()
-    return _tx_follow(tx, viewer_uid, target_uid)
+    try:
+        _run_follow_tx(_tx_follow, viewer_uid, target, _follower_entry(viewer_uid, viewer))
+    finally:
+        invalidate_user_cache(viewer_uid, target_uid)
+    return {"isFollowing": True, "followersCount": _followers_count(target) + _follower_shard_total(target_uid)}
 
 def unfollow_user(viewer_uid: str, target_slug: str) -> Dict[str, Any]:
+    target, _ = _resolve_follow_pair(viewer_uid, target_slug, "unfollow")
+    target_uid = target["id"]
+    try:
+        _run_follow_tx(_tx_unfollow, viewer_uid, target)
+    finally:
+        invalidate_user_cache(viewer_uid, target_uid)
+    return {"isFollowing": False, "followersCount": max(0, _followers_count(target) + _follower_shard_total(target_uid))}
+
+# Targets per bulk transaction: 2 writes each (+1 on the viewer) stays far below
+# the 500-write commit cap while keeping each transaction's lock window short
+FOLLOW_BULK_CHUNK = 20
+
+@firestore.transactional
+def _tx_follow_many(
+    transaction: Transaction, viewer_uid: str, target_uids: List[str], follower_entry: Dict[str, Any],
+) -> int:
+    viewer_ref = _get_user_doc(viewer_uid)
+    viewer_snap = viewer_ref.get(field_paths=["following"], transaction=transaction)
+    following = set((viewer_snap.to_dict() or {}).get("following") or [])
+    new = [t for t in target_uids if t not in following]
+    if not new:
+        return 0
+
+    transaction.update(viewer_ref, {"following": firestore.ArrayUnion(new)})
+    entry = {**follower_entry, "createdAt": firestore.SERVER_TIMESTAMP}
+    for t in new:
+        transaction.set(_followers_details_ref(t, viewer_uid), entry)
+        transaction.set(_follower_shard(t), {"followers": firestore.Increment(1)}, merge=True)
+    return len(new)
+
+def follow_users_bulk(viewer_uid: str, target_uids: List[str]) -> int:
+    """
+    Follow many users at once (e.g. a contact import): one transaction per
+    FOLLOW_BULK_CHUNK targets instead of one per target. Unknown uids, the viewer
+    itself and already-followed users are skipped. Returns the number of new follows.
+    """
     if not viewer_uid:
         raise PermissionError("unauthorized")
-    target = get_user_by_slug(target_slug)
-    if not target:
-        raise LookupError("target not found")
-    target_uid = target["id"]
-    if target_uid == viewer_uid:
-        raise ValueError("cannot unfollow yourself")
-    tx = db.transaction()
-    return _tx_unfollow(tx, viewer_uid, target_uid)
+    viewer = get_user_by_uid(viewer_uid, FOLLOWER_ENTRY_FIELDS)
+    if not viewer:
+        raise ValueError("user not found")
+    wanted = [t for t in dict.fromkeys(target_uids or []) if t and t != viewer_uid]
+    if not wanted:
+        return 0
+
+    # Existence-only reads (empty field mask), one RPC for all targets
+    snaps = _db().get_all([_get_user_doc(t) for t in wanted], field_paths=[])
+    existing = {snap.id for snap in snaps if snap.exists}
+    targets = [t for t in wanted if t in existing]
+
+    entry = _follower_entry(viewer_uid, viewer)
+    added = 0
+    try:
+        for i in range(0, len(targets), FOLLOW_BULK_CHUNK):
+            added += _run_follow_tx(_tx_follow_many, viewer_uid, targets[i:i + FOLLOW_BULK_CHUNK], entry)
+    finally:
+        invalidate_user_cache(viewer_uid, *targets)
+    return added
 
 # ------------------------------------------------------------
 # Maintenance helpers
 # ------------------------------------------------------------
 
-def backfill_all_slugs(batch_size: int = 400) -> int:
-    """
-    Populate 'slug' for all users that don't have one.
-    Returns number of updated docs.
-    """
-    updated = 0
-    batch = db.batch()
-    ops = 0
+# Batch commits in the maintenance helpers retry transient contention/outages
+_COMMIT_RETRY = gretry.Retry(
+    predicate=gretry.if_exception_type(gexc.Aborted, gexc.DeadlineExceeded, gexc.ServiceUnavailable),
+    initial=0.1,
+    maximum=2.0,
+    multiplier=2.0,
+    deadline=60.0,
+)
 
-    for doc in db.collection("users").stream():
+def _slug_patches() -> Iterable[Tuple[Any, Dict[str, Any]]]:
+    """(doc snapshot, fields to update) for every user whose slug/slugAliases is stale."""
+    # Only what derive_slug / slug_aliases read
+    for doc in stream_paged(_users().select(["slug", "slugAliases", "firstName", "lastName", "fullName"])):
         u = doc.to_dict() or {}
+        patch: Dict[str, Any] = {}
         if not u.get("slug"):
             s = derive_slug(u)
             if s:
-                batch.update(doc.reference, {"slug": s})
-                updated += 1
-                ops += 1
-                if ops >= batch_size:
-                    batch.commit()
-                    batch = db.batch()
-                    ops = 0
+                u["slug"] = patch["slug"] = s
+        aliases = slug_aliases(u)
+        if aliases != (u.get("slugAliases") or []):
+            patch["slugAliases"] = aliases
+        if patch:
+            yield doc, patch
 
-    if ops:
-        batch.commit()
+# Attempts per write before BulkWriter gives up on it (its own default is 15)
+BACKFILL_MAX_ATTEMPTS = 10
 
-    return updated
-
-def ensure_user_slug(uid: str, user: Dict[str, Any]) -> Dict[str, Any]:
+def backfill_all_slugs() -> int:
     """
-    (Re-declared above; kept here for clarity if importing elsewhere)
-    Ensure a 'slug' exists for this user; if missing, derive and persist it.
+    Populate 'slug' for all users that don't have one, and refresh 'slugAliases'.
+    BulkWriter pipelines the writes (parallel, 500/50/5 ramp, retries).
+    Returns the number of user docs actually updated.
     """
-    if user.get("slug"):
-        return user
-    s = derive_slug(user)
-    if s:
-        _get_user_doc(uid).update({"slug": s})
-        user["slug"] = s
-    return user
+    user_paths: Set[str] = set()
+    written: Set[str] = set()
+    lock = threading.Lock()
+
+    # Only writes the server acknowledged count; a write is dropped (and not
+    # counted) once it has failed BACKFILL_MAX_ATTEMPTS times
+    def on_result(ref, _result, _writer) -> None:
+        if ref.path in user_paths:
+            with lock:
+                written.add(ref.path)
+
+    def on_error(err, _writer) -> bool:
+        return err.attempts < BACKFILL_MAX_ATTEMPTS
+
+    bw = _db().bulk_writer()
+    bw.on_write_result(on_result)
+    bw.on_write_error(on_error)
+    try:
+        for doc, patch in _slug_patches():
+            user_paths.add(doc.reference.path)
+            bw.update(doc.reference, patch)
+            if "slug" in patch:
+                _index_slug(doc.id, patch["slug"], bw)
+        bw.close()  # flushes and waits for every queued write
+    finally:
+        invalidate_user_cache()
+    return len(written)
 
 class Experience(TypedDict, total=False):
     id: str
@@ -423,6 +785,7 @@ class Experience(TypedDict, total=False):
     logoUrl: str
     createdAt: str
     updatedAt: str
+    sortKey: str       # list order, see _experience_sort_key
 
 # --- add these helpers somewhere below the Experience type ---
 
@@ -523,7 +886,7 @@ def add_my_experience(authorization_header: Optional[str], payload: Dict[str, An
         return {"ok": False, "error": err}
 
     try:
-        item = upsert_experience(uid, cast(Dict[str, Any], clean))
+        item = upsert_experience(uid, clean)  # type: ignore[arg-type]
         # Compatibility: if old readers expect 'technologies', mirror from skills in response only
         if "skills" in item and "technologies" not in item:
             item["technologies"] = list(item.get("skills") or [])
@@ -533,43 +896,77 @@ def add_my_experience(authorization_header: Optional[str], payload: Dict[str, An
 
 
 
+# Everything the Experience type declares (the profile page renders all of it);
+# projecting to these keeps stray fields on old docs off the wire
+EXPERIENCE_FIELDS = [
+    "title", "company", "employmentType", "location", "startDate", "endDate", "current",
+    "description", "skills", "technologies", "logoUrl", "createdAt", "updatedAt",
+]
+
+@lru_cache(maxsize=4096)
 def _experience_collection(uid: str):
     return _get_user_doc(uid).collection("experience")
 
 
+def _experience_sort_key(x: Dict[str, Any]) -> str:
+    """
+    Stored as 'sortKey' so Firestore returns rows already ordered (descending):
+    bucket 0 = current (by startDate), bucket 1 = past (endDate, fallback startDate).
+    """
+    start = str(x.get("startDate") or "")
+    if x.get("current"):
+        return "0_" + start
+    return "1_" + (str(x.get("endDate") or "") or start)
+
+def backfill_experience_sort_keys(batch_size: int = 400) -> int:
+    """
+    Write 'sortKey' on experience rows saved before it existed so every row
+    carries its list order. Returns number updated.
+    """
+    db = _db()
+    rows = db.collection_group("experience").select(["current", "startDate", "endDate", "sortKey"])
+    updated = 0
+    batch = db.batch()
+    ops = 0
+    for d in stream_paged(rows):
+        data = d.to_dict() or {}
+        key = _experience_sort_key(data)
+        if data.get("sortKey") != key:
+            batch.update(d.reference, {"sortKey": key})
+            updated += 1
+            ops += 1
+            if ops >= batch_size:
+                batch.commit(retry=_COMMIT_RETRY)
+                batch = db.batch()
+                ops = 0
+    if ops:
+        batch.commit(retry=_COMMIT_RETRY)
+    return updated
+
 def list_experience_for_uid(uid: str) -> List[Experience]:
     """
     Returns experience for a user, auto-ordered:
       1. Current roles first (sorted by startDate desc)
       2. Then past roles (sorted by endDate desc, fallback startDate desc)
     """
-    docs = list(_experience_collection(uid).stream())
-    items: List[Experience] = []
-    for d in docs:
+    # No order_by("sortKey"): Firestore would silently drop rows saved before the
+    # field existed. A profile holds a handful of rows, so sort them here and
+    # compute the key for any legacy row that lacks it.
+    rows = []
+    for d in _experience_collection(uid).select(EXPERIENCE_FIELDS + ["sortKey"]).stream():
         data = d.to_dict() or {}
-        data["id"] = d.id
+        rows.append((data.pop("sortKey", None) or _experience_sort_key(data), d.id, data))
+    rows.sort(key=lambda r: r[0], reverse=True)
+
+    items: List[Experience] = []
+    for _, doc_id, data in rows:
+        data["id"] = doc_id
 
         # migrate legacy: map old technologies -> skills
         if "skills" not in data and "technologies" in data:
             data["skills"] = list(data.get("technologies") or [])
 
         items.append(cast(Experience, data))
-
-    def sort_key(x: Dict[str, Any]):
-        current = bool(x.get("current"))
-        start = str(x.get("startDate") or "")
-        end = str(x.get("endDate") or "")
-
-        # current roles: rank highest, then sort by startDate
-        if current:
-            return (0, start)  # bucket 0 = current, sort by start desc later
-
-        # past roles: bucket 1, prefer endDate; if missing, fallback to startDate
-        key_date = end or start
-        return (1, key_date)
-
-    # sort by bucket, then date desc (reverse=True)
-    items.sort(key=sort_key, reverse=True)
     return items
 
 
@@ -589,14 +986,17 @@ def upsert_experience(uid: str, data: Dict[str, Any], exp_id: Optional[str] = No
     col = _experience_collection(uid)
     if exp_id:
         ref = col.document(exp_id)
-        in_db = ref.get().to_dict() or {}
-        merged = {**in_db, **data, "updatedAt": now}
+        # set(merge=True) merges server-side: no read needed. The validated payload
+        # always carries current/startDate (and endDate when past) for the sortKey.
+        merged = {**data, "updatedAt": now, "sortKey": _experience_sort_key(data)}
         ref.set(merged, merge=True)
         merged["id"] = exp_id
         return merged  # type: ignore[return-value]
     else:
         doc_ref = col.document()
-        payload = {**data, "createdAt": now, "updatedAt": now}
+        payload = data.copy()
+        payload["createdAt"] = payload["updatedAt"] = now
+        payload["sortKey"] = _experience_sort_key(data)
         doc_ref.set(payload)
         payload["id"] = doc_ref.id
         return payload  # type: ignore[return-value]
\ No newline at end of file
@@ -1,91 +1,110 @@
 # search.py
 from __future__ import annotations
 
-import os
-import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any
 
-import firebase_admin
-from firebase_admin import credentials, firestore
+from common import get_db, stream_paged
+from profiles_api import SEARCH_NGRAM_MAX, kebab_any, name_ngrams, name_tokens, search_full_name
 
-# --------------------------------------------------------------------
-# Firebase Admin init (idempotent)
-# --------------------------------------------------------------------
-SERVICE_ACCOUNT_PATH = os.getenv(
-    "GOOGLE_APPLICATION_CREDENTIALS",
-    "neru-b3128-firebase-adminsdk-fbsvc-11110f3ad3.json",
-)
-if not firebase_admin._apps:
-    cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
-    firebase_admin.initialize_app(cred)
-
-db = firestore.client()
+# Shared process-wide client (common.get_db initializes Firebase once)
+_db = get_db
 
 # --------------------------------------------------------------------
 # Helpers
 # --------------------------------------------------------------------
-def _slugify(full_name: str) -> str:
-    s = re.sub(r"[^a-zA-Z0-9\s-]", "", full_name or "").strip().lower()
-    s = re.sub(r"\s+", "-", s)
-    s = re.sub(r"-{2,}", "-", s)
-    return s
-
-def _name_tokens(full_name: str) -> List[str]:
-    """
-    Break a name into lowercased tokens plus progressive prefixes for quick search.
-    e.g. "Diego Cicotoste" -> ["diego","di","die","dieg","cicotoste","ci","cic","cico",...]
-    """
-    clean = re.sub(r"[^a-zA-Z0-9\s-]", " ", full_name or "").strip().lower()
-    parts = [p for p in re.split(r"\s+", clean) if p]
-    toks: List[str] = []
-    for p in parts:
-        toks.append(p)
-        for k in range(2, min(len(p), 6) + 1):
-            toks.append(p[:k])
-    # de-dupe while preserving order
-    seen = set()
-    out: List[str] = []
-    for t in toks:
-        if t not in seen:
-            out.append(t)
-            seen.add(t)
-    return out
+# One slug function for the whole backend (translate fast path for ASCII names)
+_slugify = kebab_any
 
 def ensure_user_search_fields(user: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Returns a copy of user with 'fullNameLower' and 'nameTokens' computed if missing.
+    Returns a copy of user with 'fullNameLower' and 'nameTokens' computed if missing
+    (or user itself when they, 'fullName' and 'slug' are already stored and current).
     """
+    full = user.get("fullName")
+    if full and user.get("nameTokens") and user.get("slug") and user.get("fullNameLower") == full.lower():
+        return user
     u = dict(user)
-    full = u.get("fullName") or " ".join([u.get("firstName", "") or "", u.get("lastName", "") or ""]).strip()
+    full = search_full_name(u)
     u["fullName"] = full
     u["fullNameLower"] = (full or "").lower()
-    u["nameTokens"] = u.get("nameTokens") or _name_tokens(full)
+    u["nameTokens"] = u.get("nameTokens") or name_tokens(full)
     u["slug"] = u.get("slug") or _slugify(full)
     return u
 
 # --------------------------------------------------------------------
 # Admin/maintenance (optional)
 # --------------------------------------------------------------------
-def backfill_search_fields(limit: int = 500):
+# Firestore caps a WriteBatch at 500 operations
+BACKFILL_BATCH = 500
+# Batch commits are RTT-bound: keep several in flight while the next one fills
+BACKFILL_WORKERS = 8
+# Only what ensure_user_search_fields reads
+SEARCH_SOURCE_FIELDS = ["fullName", "firstName", "lastName", "fullNameLower", "nameTokens", "slug"]
+# ...plus what a result card shows; search queries project to just these
+SEARCH_CARD_FIELDS = SEARCH_SOURCE_FIELDS + ["avatarUrl"]
+# Most users the n-gram query will fetch for one search
+SEARCH_NGRAM_MAX_CANDIDATES = 400
+# Users without searchNgrams (not yet backfilled, or created client-side by
+# onboarding's setDoc) are only found by this small scan
+SEARCH_SCAN_LIMIT = 400
+
+def backfill_search_fields(page_size: int = 500):
     """
-    Backfill 'fullNameLower' and 'nameTokens' into user docs (dev helper).
+    Backfill 'fullNameLower', 'nameTokens' and 'searchNgrams' into every user
+    doc (dev helper).
     """
+    db = _db()
     users_ref = db.collection("users")
-    docs = users_ref.limit(limit).stream()
+    docs = stream_paged(users_ref.select(SEARCH_SOURCE_FIELDS + ["searchNgrams"]), page_size)
     count = 0
-    for d in docs:
-        u = d.to_dict() or {}
-        updated = ensure_user_search_fields(u)
-        if (u.get("fullNameLower") != updated["fullNameLower"]) or (u.get("nameTokens") != updated["nameTokens"]) or (u.get("slug") != updated["slug"]):
-            users_ref.document(d.id).update({
-                "fullName": updated["fullName"],
-                "fullNameLower": updated["fullNameLower"],
-                "nameTokens": updated["nameTokens"],
-                "slug": updated["slug"],
-            })
-            count += 1
+    batch = db.batch()
+    ops = 0
+    commits = []
+    with ThreadPoolExecutor(max_workers=BACKFILL_WORKERS, thread_name_prefix="search-backfill") as pool:
+        for d in docs:
+            u = d.to_dict() or {}
+            updated = ensure_user_search_fields(u)
+            ngrams = name_ngrams(updated["fullNameLower"])
+            if (u.get("fullNameLower") != updated["fullNameLower"]) or (u.get("nameTokens") != updated["nameTokens"]) or (u.get("slug") != updated["slug"]) or (u.get("searchNgrams") != ngrams):
+                batch.update(d.reference, {
+                    "fullName": updated["fullName"],
+                    "fullNameLower": updated["fullNameLower"],
+                    "nameTokens": updated["nameTokens"],
+                    "searchNgrams": ngrams,
+                    "slug": updated["slug"],
+                })
+                count += 1
+                ops += 1
+                if ops >= BACKFILL_BATCH:
+                    commits.append(pool.submit(batch.commit))
+                    batch = db.batch()
+                    ops = 0
+        if ops:
+            commits.append(pool.submit(batch.commit))
+        for f in commits:
+            f.result()
     return {"updated": count}
 
+def _rank_substring_matches(snaps, q: str, limit: int) -> List[Dict[str, Any]]:
+    """Cards whose name contains q: prefix matches first, then the rest."""
+    starts: List[Dict[str, Any]] = []
+    subs: List[Dict[str, Any]] = []
+    for d in snaps:
+        u = ensure_user_search_fields(d.to_dict() or {})
+        if q in u["fullNameLower"]:
+            card = {
+                "id": d.id,
+                "fullName": u["fullName"],
+                "slug": u.get("slug") or _slugify(u["fullName"]),
+                "avatarUrl": u.get("avatarUrl") or None,
+            }
+            (starts if u["fullNameLower"].startswith(q) else subs).append(card)
+            if len(starts) >= limit:
+                # nothing later can outrank a full page of prefix matches
+                break
+    return (starts + subs)[:limit]
+
 # --------------------------------------------------------------------
 # Search
 # --------------------------------------------------------------------
@@ -94,20 +113,22 @@ def search_users(query: str, limit: int = 8) -> List[Dict[str, Any]]:
     Search users by name. Tries indexed search first:
       - array-contains on 'nameTokens' for the first token/prefix
       - (optional) 'fullNameLower' prefix search if indexed (best effort)
-    Falls back to in-Python filtering of up to 400 docs for dev.
+    Falls back to the 'searchNgrams' field (substring matches anywhere in the name),
+    then to a small scan for users that do not have it yet.
     Returns minimal cards: id, fullName, slug, avatarUrl
     """
     q = (query or "").strip().lower()
     if len(q) < 2:
         return []
 
-    users_ref = db.collection("users")
+    users = _db().collection("users")
+    users_ref = users.select(SEARCH_CARD_FIELDS)
     results: List[Dict[str, Any]] = []
 
     # Try fast path: nameTokens array-contains
     try:
-        docs = list(users_ref.where("nameTokens", "array_contains", q[:6]).limit(limit * 2).stream())
-        for d in docs:
+        # Iterate the stream itself: breaking early cancels the rest of the RPC
+        for d in users_ref.where("nameTokens", "array_contains", q[:6]).limit(limit * 2).stream():
             u = ensure_user_search_fields(d.to_dict() or {})
             if q in u["fullNameLower"]:
                 results.append({
@@ -131,8 +152,7 @@ def search_users(query: str, limit: int = 8) -> List[Dict[str, Any]]:
                .start_at({u"fullNameLower": q})
                .end_at({u"fullNameLower": q + u"\uf8ff"})
                .limit(limit))
-        docs = list(qry.stream())
-        for d in docs:
+        for d in qry.stream():
             u = ensure_user_search_fields(d.to_dict() or {})
             results.append({
                 "id": d.id,
@@ -145,23 +165,20 @@ def search_users(query: str, limit: int = 8) -> List[Dict[str, Any]]:
     except Exception:
         pass
 
-    # Fallback: small in-memory scan (dev)
+    # Substring: array-contains on the query's leading n-gram, re-checked in Python
     try:
-        docs = list(users_ref.limit(400).stream())
-        basket: List[Dict[str, Any]] = []
-        for d in docs:
-            u = ensure_user_search_fields(d.to_dict() or {})
-            if q in u["fullNameLower"]:
-                basket.append({
-                    "id": d.id,
-                    "fullName": u["fullName"],
-                    "slug": u.get("slug") or _slugify(u["fullName"]),
-                    "avatarUrl": u.get("avatarUrl") or None,
-                })
-        # light ranking: startswith first, then substring
-        starts = [r for r in basket if r["fullName"].lower().startswith(q)]
-        subs = [r for r in basket if r not in starts]
-        ranked = starts + subs
-        return ranked[:limit]
+        snaps = (users_ref
+                 .where("searchNgrams", "array_contains", q[:SEARCH_NGRAM_MAX])
+                 .limit(SEARCH_NGRAM_MAX_CANDIDATES)
+                 .stream())
+        results = _rank_substring_matches(snaps, q, limit)
+        if results:
+            return results
+    except Exception:
+        pass
+
+    # Fallback: small in-memory scan
+    try:
+        return _rank_substring_matches(users_ref.limit(SEARCH_SCAN_LIMIT).stream(), q, limit)
     except Exception:
         return []
@@ -0,0 +1,5 @@
+# wsgi.py
+# Gunicorn entrypoint:  gunicorn -c gunicorn.conf.py wsgi:application
+from config import app
+
+application = app
@@ -9,16 +9,14 @@ type PostProps = {
     text?: string;
     mediaUrl?: string | null;
     createdAt: string;
-    likes: string[];
+    likeCount: number;
+    likedByMe: boolean;
     commentsCount: number;
     handleLikePost: (postId:string) => void;
 };
 
-export default function Post({ id, userId, userFullName, text, mediaUrl, createdAt, likes, commentsCount, handleLikePost }: PostProps) {
-    const auth = getAuth();
-    const currentUser = auth.currentUser;
-    const currentUid = currentUser?.uid;
-    const alreadyLiked = currentUid ? likes.includes(currentUid) : false;
+export default function Post({ id, userId, userFullName, text, mediaUrl, createdAt, likeCount, likedByMe, commentsCount, handleLikePost }: PostProps) {
+    const alreadyLiked = !!getAuth().currentUser && likedByMe;
     
   return (
     <div className="post-card">
@@ -48,7 +46,7 @@ export default function Post({ id, userId, userFullName, text, mediaUrl, created
           onClick={() => handleLikePost(id)}
           className={`post-like-btn ${alreadyLiked ? "liked" : ""}`}
         >
-          {alreadyLiked ? "♥" : "♡"} {likes.length} Like
+          {alreadyLiked ? "♥" : "♡"} {likeCount} Like
         </button>
         {/* <span className="post-comments">{commentsCount} Comments</span> */}
       </div>
@@ -9,15 +9,13 @@ type PostProps = {
     text?: string;
     mediaUrl?: string | null;
     createdAt: string;
-    likes: string[];
+    likeCount: number;
+    likedByMe: boolean;
     commentsCount: number;
 };
 
-export default function PostMini({ id, userId, userFullName, text, mediaUrl, createdAt, likes, commentsCount }: PostProps) {
-    const auth = getAuth();
-    const currentUser = auth.currentUser;
-    const currentUid = currentUser?.uid;
-    const alreadyLiked = currentUid ? likes.includes(currentUid) : false;
+export default function PostMini({ id, userId, userFullName, text, mediaUrl, createdAt, likeCount, likedByMe, commentsCount }: PostProps) {
+    const alreadyLiked = !!getAuth().currentUser && likedByMe;
 
   const previewText = text && text.length > 120 ? text.slice(0, 120) + "…" : text;
     
@@ -43,7 +41,7 @@ export default function PostMini({ id, userId, userFullName, text, mediaUrl, cre
 
       {/* Stats */}
       <div className="post-mini-stats">
-        <span>{likes.length} {likes.length === 1 ? "like" : "likes"}</span>
+        <span>{likeCount} {likeCount === 1 ? "like" : "likes"}</span>
         <span>·</span>
         <span>{commentsCount} {commentsCount === 1 ? "comment" : "comments"}</span>
       </div>
@@ -1,5 +1,5 @@
 // src/pages/Home.tsx
-import React, { useEffect, useState } from "react";
+import React, { useCallback, useEffect, useState } from "react";
 import { Navigate } from "react-router-dom";
 import "../css/Home.css";
 import Header from "../components/Header";
@@ -19,7 +19,8 @@ export type PostData = {
   mediaUrl?: string | null;
   mediaType?: string | null;
   createdAt: string;
-  likes: string[];
+  likeCount: number;
+  likedByMe: boolean;
   commentsCount: number;
 };  
 
@@ -30,6 +31,8 @@ export default function Home() {
   const [authorized, setAuthorized] = useState(true);
   const [newPost, setNewPost] = useState(false)
   const [posts, setPosts] = useState<PostData[]>([])
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
+  const [loadingMore, setLoadingMore] = useState(false)
   const [activeTab, setActiveTab] = useState<"quickconnect" | "posts">("posts")
 
   useEffect(() => {
@@ -46,24 +49,41 @@ export default function Home() {
     })();
   }, []);
 
-  useEffect(() => {
-    async function fetchPosts() {
-      try {
-        const res = await fetch(`${API_URL}/api/posts`)
-        const data = await res.json()
-        if (data.ok) {
-          console.log(data)
-          setPosts(data.posts)
-        } else {
-          console.error('Failed to fetch', data.error)
-        }
-      } catch (error) {
-        console.error("Error fetching posts:", error);
+  // One page per call; `after` is the nextCursor of the previous page
+  const fetchPosts = useCallback(async (after?: string) => {
+    try {
+      const token = await getAuth().currentUser?.getIdToken();
+      const url = after
+        ? `${API_URL}/api/posts?after=${encodeURIComponent(after)}`
+        : `${API_URL}/api/posts`;
+      const res = await fetch(url, {
+        headers: token ? { Authorization: `Bearer ${token}` } : {},
+      })
+      const data = await res.json()
+      if (data.ok) {
+        setPosts((prev) => (after ? [...prev, ...data.posts] : data.posts))
+        setNextCursor(data.nextCursor ?? null)
+      } else {
+        console.error('Failed to fetch', data.error)
       }
+    } catch (error) {
+      console.error("Error fetching posts:", error);
     }
+  }, [])
 
+  useEffect(() => {
     fetchPosts()
-  }, [])
+  }, [fetchPosts])
+
+  const handleLoadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      await fetchPosts(nextCursor);
+    } finally {
+      setLoadingMore(false);
+    }
+  }
 
   const handlePopUp = (close:boolean) => {
     setNewPost(close)
@@ -86,16 +106,13 @@ export default function Home() {
     const user = auth.currentUser;
     if (!user) return;
 
-    const uid = user.uid;
-
     setPosts((prevPosts) =>
       prevPosts.map((post) =>
         post.id === postId
           ? {
               ...post,
-              likes: post.likes.includes(uid)
-                ? post.likes.filter((id) => id !== uid) 
-                : [...post.likes, uid],
+              likedByMe: !post.likedByMe,
+              likeCount: post.likeCount + (post.likedByMe ? -1 : 1),
             }
           : post
       )
@@ -189,11 +206,21 @@ export default function Home() {
                     text={post.text}
                     mediaUrl={post.mediaUrl}
                     createdAt={post.createdAt}
-                    likes={post.likes}
+                    likeCount={post.likeCount}
+                    likedByMe={post.likedByMe}
                     commentsCount={post.commentsCount}
                     handleLikePost={handleLikePost}
                   />
                 ))}
+                {nextCursor && (
+                  <button
+                    className="load-more-btn"
+                    onClick={handleLoadMore}
+                    disabled={loadingMore}
+                  >
+                    {loadingMore ? "Loading…" : "Load more"}
+                  </button>
+                )}
               </>
             )}
           </div>
@@ -115,7 +115,8 @@ export type PostData = {
   mediaUrl?: string | null;
   mediaType?: string | null;
   createdAt: string;
-  likes: string[];
+  likeCount: number;
+  likedByMe: boolean;
   commentsCount: number;
 };
 
@@ -860,7 +861,8 @@ export default function ProfilePage() {
                     text={post.text}
                     mediaUrl={post.mediaUrl}
                     createdAt={post.createdAt}
-                    likes={post.likes}
+                    likeCount={post.likeCount}
+                    likedByMe={post.likedByMe}
                     commentsCount={post.commentsCount}
                   />
                 ))}